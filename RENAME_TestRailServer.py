@@ -9,6 +9,58 @@ def get_testrail_srv_info():
     tr_srv['TESTRAIL_PROJECT_ID'] = 1
     tr_srv['TESTRAIL_USER']       = 'buildmaster@example.com'
     tr_srv['TESTRAIL_PW']         = '12345678'
+
+    # Optional settings. Listener uses the default shown if a setting is not given.
+    #
+    # max persistent connections to TestRail that are open at once
+    tr_srv['TESTRAIL_POOL_SIZE']        = 4
+    # secs to wait to connect to TestRail and for each read of a response. HTTP(S)_PROXY and
+    # NO_PROXY environment variables are used
+    tr_srv['TESTRAIL_TIMEOUT']          = 60
+    # TestRailCasesListener creates this many Cases at once. Cases of a section may then not be in
+    # the order of the RF tests. keep at or below TESTRAIL_POOL_SIZE
+    tr_srv['TESTRAIL_CONCURRENCY']      = 4
+    # retries of requests TestRail rate limited (429) or that could not be sent. GETs and idempotent
+    # POSTs are also retried on 5xx or a connection error.
+    tr_srv['TESTRAIL_MAX_RETRIES']      = 5
+    # max requests per minute sent to TestRail. None to not limit. split the server's limit between
+    # robot runs that share it
+    tr_srv['TESTRAIL_REQUESTS_PER_MINUTE'] = None
+    # gzip request bodies of 1KB or more. TestRail's web server must accept gzipped requests
+    tr_srv['TESTRAIL_COMPRESS_REQUESTS'] = False
+    # send Results from a background thread so RF tests do not wait on TestRail
+    tr_srv['TESTRAIL_ASYNC_RESULTS']    = False
+    tr_srv['TESTRAIL_ASYNC_QUEUE_SIZE'] = 1000  # max Results waiting to be sent
+    tr_srv['TESTRAIL_ASYNC_TIMEOUT']    = 300   # secs to wait at end of run for queued Results to be sent
+    # send Results in batches with one add_results_for_cases call. 1 sends each Result on its own
+    tr_srv['TESTRAIL_BATCH_SIZE']       = 1
+    tr_srv['TESTRAIL_BATCH_INTERVAL']   = 30    # max secs a Result waits in a batch
+    # record Results in tr_results_journal.jsonl in RF output dir so those not uploaded can be sent later
+    tr_srv['TESTRAIL_JOURNAL']          = False
+    # send the last RF keywords of failed tests as TestRail step results. Cases need a template with steps
+    tr_srv['TESTRAIL_STEP_RESULTS']     = False
+    tr_srv['TESTRAIL_STEP_RESULTS_MAX'] = 50    # keywords kept of each test
+    tr_srv['TESTRAIL_STEP_RESULTS_FIELD_SIZE'] = 250 # max chars of each step field
+    # upload screenshots of failed tests to their Results and RF log.html to the Run in the background
+    tr_srv['TESTRAIL_ATTACHMENTS']      = False
+    tr_srv['TESTRAIL_ATTACHMENTS_MAX_BYTES'] = 50 * 1024 * 1024 # max bytes uploaded in a run
+    # get all Sections and Cases of the TestRail test suite once at start of run. TestRailCasesListener
+    # then also creates the Sections of all RF suites of the run at start, a level at a time
+    tr_srv['TESTRAIL_PREFETCH']         = False
+    # add the Run to the Plan once with all tests of the run. also enables TESTRAIL_PREFETCH
+    tr_srv['TESTRAIL_SINGLE_ENTRY']     = False
+    # dir of file cache of the Sections and Cases prefetched. None to not cache them.
+    # the IDs of the Automated case type, TestRail user, Milestones, and Plans are cached here too, or in the temp dir if None
+    tr_srv['TESTRAIL_CACHE_DIR']        = None
+    tr_srv['TESTRAIL_CACHE_MAX_AGE']    = 86400 # secs before all Cases are received again
+    # robot processes started by pabot share one Milestone, Plan, and Run
+    tr_srv['TESTRAIL_SHARED_RUN']       = False
+    tr_srv['TESTRAIL_SHARED_RUN_DIR']   = None  # dir of shared Run state. None for pabot's results dir
+    tr_srv['TESTRAIL_SHARED_RUN_ID']    = None  # ID of this invocation, e.g. CI build ID. None for an ID new each pabot run
+    # Unix socket of TestRailDaemon.py. Listeners send requests and Results to it. None to send them to TestRail
+    tr_srv['TESTRAIL_DAEMON_SOCKET']    = None
+    # write summary of time in Listener events and TestRail requests as JSON, e.g. tr_listener_stats.json
+    tr_srv['TESTRAIL_STATS']            = True
     return tr_srv
 
 
@@ -7,16 +7,53 @@
 # http://docs.gurock.com/testrail-api2/start
 # http://docs.gurock.com/testrail-api2/accessing
 #
-import urllib2, json, base64
+import urllib, urllib2, urlparse, base64, zlib, StringIO
+import httplib, socket, threading, Queue
+import email.utils, os, random, select, time, uuid
+
+# faster C encoder and decoder if installed. same api as json.
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from TestRailStats import CallStats
 
 
 class TestRailAPIClient:
 
+    # POST bodies smaller than this are not worth compressing
+    COMPRESS_MIN_SIZE = 1024
 
-    def __init__(self, server, protocol='http', user=None, password=None):
+    def __init__(self, server, protocol='http', user=None, password=None, pool_size=4, timeout=60,
+            max_retries=5, backoff=1.0, max_backoff=60, requests_per_minute=None, compress_requests=False):
         self.user = user
         self.password = password
+        # requests that fail with 429 (rate limited), or that could not be sent, are retried up to
+        # max_retries times after waiting Retry-After secs if server sent it or a jittered exponential
+        # backoff of backoff * 2^retry secs up to max_backoff.  GETs and idempotent POSTs are also
+        # retried on 5xx and connection errors.  Other POSTs are not as TR may have applied them,
+        # e.g. when a proxy times out, and sending them again would add duplicates.
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # requests are paced client side so server does not need to rate limit them
+        self.__rate_limiter = TokenBucket(requests_per_minute) if requests_per_minute else None
         self.__url = '{}://{}/{}'.format(protocol, server, 'index.php?/api/v2/')
+        # server can include a path, e.g. example.com/testrail
+        host, _, path = server.partition('/')
+        path = path.strip('/')
+        self.__path = '/{}index.php?/api/v2/'.format(path + '/' if path else '')
+        # persistent connections are reused for all requests. timeout is secs to wait to connect
+        # and for each read, so a hung server fails the request instead of blocking forever.
+        # HTTP(S)_PROXY and NO_PROXY are used as urllib2 does.
+        self.__pool = ConnectionPool(protocol, host, size=pool_size, timeout=timeout)
+        self.__auth = None
+        self.__auth_key = None
+        # gzip POST bodies. TestRail's web server must be set up to accept them.
+        self.compress_requests = compress_requests
+        # latency, status, bytes, and retries of each request by method and endpoint
+        self.stats = CallStats()
 
     def send_get(self, uri):
         '''
@@ -32,9 +69,9 @@ class TestRailAPIClient:
                              (e.g. get_case/1)
 
          '''
-        return self.__send_request('GET', uri, None)
+        return self.__send_request('GET', uri, None, idempotent=True)
 
-    def send_post(self, uri, data={}):
+    def send_post(self, uri, data={}, idempotent=False):
         '''
 
         Send POST
@@ -48,38 +85,190 @@ class TestRailAPIClient:
                             (e.g. add_case/1)
         data                The data to submit as part of the request (as
                             Python dict, strings must be UTF-8 encoded)
+        idempotent          True if sending the request twice has the same
+                            effect as once, so it is retried on 5xx and
+                            connection errors
         '''
-        return self.__send_request('POST', uri, data)
-
-    def __send_request(self, method, uri, data):
-        url = self.__url + uri
-        request = urllib2.Request(url)
-        if method == 'POST':
-            request.add_data(json.dumps(data))
-        auth = base64.b64encode('{}:{}'.format(self.user, self.password))
-        request.add_header('Authorization', 'Basic {}'.format(auth))
-        request.add_header('Content-Type', 'application/json')
-
-        e = None
-        try:
-            response = urllib2.urlopen(request).read()
-        except urllib2.HTTPError as e:
-            response = e.read()
+        return self.__send_request('POST', uri, data, idempotent=idempotent)
 
-        if response:
-            result = json.loads(response)
-        else:
-            result = {}
+    def send_get_pages(self, uri, key):
+        '''
+
+        Send GET Pages
+
+        Issues GET requests (read) for a bulk API method and yields its entries.
+
+        TestRail 6.7 and later return bulk entries in pages of at most 250, e.g.
+        {'offset': 0, 'limit': 250, 'size': 250, '_links': {'next': '/api/v2/get_cases/1&offset=250'}, 'cases': [...]}
+        Each page is requested and decoded only when entries of the previous one
+        have been used.  Older versions return all entries in one list.
+
+        Arguments:
 
-        if e is not None:
+        uri                 The API method to call including parameters
+                            (e.g. get_cases/1&suite_id=2)
+        key                 Key of the entries in a page (e.g. cases)
+        '''
+        while uri:
+            page = self.send_get(uri)
+            if isinstance(page, list):
+                for entry in page:
+                    yield entry
+                return
+            for entry in page[key]:
+                yield entry
+            next_page = (page.get('_links') or {}).get('next')
+            uri = next_page.split('/api/v2/', 1)[1] if next_page else None
+
+    def send_attachment(self, uri, path):
+        '''
+
+        Send Attachment
+
+        Issues a POST request that uploads a file as multipart/form-data and
+        returns the result (as Python dict).  The file is read from disk as
+        it is sent so it is never held whole in memory.
+
+        Arguments:
+
+        uri                 The API method to call including parameters
+                            (e.g. add_attachment_to_result/1)
+        path                Path of the file to upload
+        '''
+        return self.__send_request('POST', uri, None, upload=MultipartFile(path))
+
+    def __send_request(self, method, uri, data, upload=None, idempotent=False):
+        body = None
+        json_bytes_out = 0
+        # responses are gzipped by TestRail's web server if it is enabled there
+        headers = {'Authorization': self.__get_auth(), 'Content-Type': 'application/json', 'Accept-Encoding': 'gzip'}
+        if upload is not None:
+            body = upload
+            headers['Content-Type'] = upload.content_type
+            headers['Content-Length'] = str(len(upload))
+        elif method == 'POST':
+            body = json.dumps(data, separators=(',', ':'))
+            json_bytes_out = len(body)
+            if self.compress_requests and len(body) >= self.COMPRESS_MIN_SIZE:
+                body = gzip_encode(body)
+                headers['Content-Encoding'] = 'gzip'
+
+        start = time.time()
+        status = 0
+        response = ''
+        wire_bytes_in = 0
+        decode_secs = 0
+        retry = 0
+        try:
+            while True:
+                if self.__rate_limiter is not None:
+                    self.__rate_limiter.acquire()
+                try:
+                    status, reason, response_headers, response = self.__urlopen(method, self.__path + uri, body,
+                            headers, idempotent)
+                except (httplib.HTTPException, socket.error) as e:
+                    # server may have got request unless it was not sent
+                    if retry >= self.max_retries or not (idempotent or isinstance(e, RequestNotSentError)):
+                        raise
+                    time.sleep(self.__get_backoff(retry))
+                    retry += 1
+                    continue
+                # 429 is rejected before it is applied. a 5xx may be from a proxy after TR applied it.
+                if (status == 429 or (status >= 500 and idempotent)) and retry < self.max_retries:
+                    time.sleep(self.__get_backoff(retry, response_headers.getheader('Retry-After')))
+                    retry += 1
+                    continue
+                break
+
+            wire_bytes_in = len(response)
+            if response and 'gzip' == (response_headers.getheader('Content-Encoding') or '').lower():
+                response = gzip_decode(response)
+            decode_start = time.time()
+            try:
+                result = json.loads(response) if response else {}
+            except ValueError:
+                if status < 400:
+                    raise
+                # error pages from proxies etc. are not json
+                result = {}
+            decode_secs = time.time() - decode_start
+        finally:
+            if upload is not None:
+                upload.close()
+            # latency includes rate limiting and retries. status 0 is a connection error.
+            # bytes are as sent on the wire. json_bytes are before compression.
+            endpoint = uri.split('/', 1)[0].split('&', 1)[0]
+            self.stats.record('{} {}'.format(method, endpoint), time.time() - start,
+                    bytes_out=len(body or ''), bytes_in=wire_bytes_in, json_bytes_out=json_bytes_out,
+                    json_bytes_in=len(response or ''), decode_secs=decode_secs, retries=retry,
+                    **{'status_{}'.format(status): 1})
+
+        if status >= 400:
             if result and 'error' in result:
                 # testrail specific exception
-                raise TestRailAPIError(e.code, result['error'])
+                raise TestRailAPIError(status, result['error'])
             else:
-                # raise last exception
-                raise
+                raise urllib2.HTTPError(self.__url + uri, status, reason, response_headers, None)
         return result
 
+    def __get_backoff(self, retry, retry_after=None):
+        # secs to wait before retry. server's Retry-After is secs or an HTTP date.
+        if retry_after:
+            try:
+                return max(0, int(retry_after))
+            except ValueError:
+                date = email.utils.parsedate_tz(retry_after)
+                if date is not None:
+                    return max(0, email.utils.mktime_tz(date) - time.time())
+        # full jitter so parallel clients do not retry in step
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** retry))
+
+    def __get_auth(self):
+        # Basic auth header is only encoded again if user or password is changed
+        if self.__auth_key != (self.user, self.password):
+            self.__auth_key = (self.user, self.password)
+            self.__auth = 'Basic {}'.format(base64.b64encode('{}:{}'.format(self.user, self.password)))
+        return self.__auth
+
+    def __urlopen(self, method, path, body, headers, idempotent):
+        # send request on a pooled connection. returns status, reason, headers, and body of response.
+        # raises RequestNotSentError if the request was not sent whole.
+        conn = self.__pool.get()
+        path = self.__pool.url_prefix + path
+        if self.__pool.headers:
+            headers = dict(headers, **self.__pool.headers)
+        reusable = False
+        try:
+            while True:
+                if conn.sock is not None and _connection_dropped(conn.sock):
+                    # server closed idle connection. find out before sending rather than after.
+                    conn.close()
+                reused = conn.sock is not None
+                if hasattr(body, 'seek'):
+                    # file body is read again for each attempt
+                    body.seek(0)
+                try:
+                    conn.request(method, path, body, headers)
+                except (httplib.HTTPException, socket.error) as e:
+                    conn.close()
+                    if not reused:
+                        raise RequestNotSentError(*e.args)
+                    # server closed idle connection. retry once on a new connection.
+                    continue
+                try:
+                    response = conn.getresponse()
+                    data = response.read()
+                    break
+                except (httplib.BadStatusLine, httplib.ResponseNotReady, socket.error):
+                    conn.close()
+                    if not reused or not idempotent:
+                        raise
+                    # server closed idle connection. retry once on a new connection.
+            reusable = not response.will_close
+            return response.status, response.reason, response.msg, data
+        finally:
+            self.__pool.put(conn, reusable)
+
     def get_projects(self):
         uri = 'get_projects'
         return self.send_get(uri)
@@ -88,9 +277,18 @@ class TestRailAPIClient:
         uri = 'get_project/{}'.format(project_id)
         return self.send_get(uri)
 
-    def get_milestones(self, project_id):
+    def get_milestones(self, project_id, is_completed=None, created_after=None):
+        return list(self.iter_milestones(project_id, is_completed=is_completed, created_after=created_after))
+
+    def iter_milestones(self, project_id, is_completed=None, created_after=None):
+        # filters are applied by TestRail so only matching milestones are received
         uri = 'get_milestones/{}'.format(project_id)
-        return self.send_get(uri)
+        if is_completed is not None:
+            uri = '{}&is_completed={}'.format(uri, int(is_completed))
+        if created_after is not None:
+            # UNIX timestamp
+            uri = '{}&created_after={}'.format(uri, int(created_after))
+        return self.send_get_pages(uri, 'milestones')
 
     def get_milestone(self, milestone_id):
         uri = 'get_milestone/{}'.format(milestone_id)
@@ -106,17 +304,27 @@ class TestRailAPIClient:
     def close_milestone(self, milestone_id):
         uri = 'update_milestone/{}'.format(milestone_id)
         data = {'is_completed': True}
-        return self.send_post(uri, data)
+        return self.send_post(uri, data, idempotent=True)
 
     def delete_milestone(self, milestone_id):
         uri = 'delete_milestone/{}'.format(milestone_id)
         return self.send_post(uri)
 
-    def get_plans(self, project_id, milestone_id=None):
+    def get_plans(self, project_id, milestone_id=None, is_completed=None, created_after=None):
+        return list(self.iter_plans(project_id, milestone_id=milestone_id, is_completed=is_completed,
+                created_after=created_after))
+
+    def iter_plans(self, project_id, milestone_id=None, is_completed=None, created_after=None):
+        # filters are applied by TestRail so only matching plans are received
         uri = 'get_plans/{}'.format(project_id)
         if milestone_id is not None:
             uri = '{}&milestone_id={}'.format(uri, milestone_id)
-        return self.send_get(uri)
+        if is_completed is not None:
+            uri = '{}&is_completed={}'.format(uri, int(is_completed))
+        if created_after is not None:
+            # UNIX timestamp
+            uri = '{}&created_after={}'.format(uri, int(created_after))
+        return self.send_get_pages(uri, 'plans')
 
     def get_plan(self, plan_id):
         uri = 'get_plan/{}'.format(plan_id)
@@ -156,7 +364,7 @@ class TestRailAPIClient:
             data['description'] = description
         if milestone_id is not None:
             data['milestone_id'] = milestone_id
-        return self.send_post(uri, data)
+        return self.send_post(uri, data, idempotent=True)
 
     def update_plan_entry(self, plan_id, entry_id, name=None, case_ids=None, run_id=None, include_all=None, description=None, assignedto_id=None):
         uri = 'update_plan_entry/{}/{}'.format(plan_id, entry_id)
@@ -178,10 +386,10 @@ class TestRailAPIClient:
                 # special behavior:
                 # perform update by adding case_ids to existing
                 # ones in the given run of this entry.
-                existing_tests = self.get_tests(run_id)
+                existing_tests = self.iter_tests(run_id)
                 for t in existing_tests:
                     data['case_ids'].append(t['case_id'])
-        return self.send_post(uri, data)
+        return self.send_post(uri, data, idempotent=True)
 
     def close_plan(self, plan_id):
         uri = 'close_plan/{}'.format(plan_id)
@@ -204,14 +412,17 @@ class TestRailAPIClient:
         return self.send_post(uri)
 
     def get_tests(self, run_id):
+        return list(self.iter_tests(run_id))
+
+    def iter_tests(self, run_id):
         uri = 'get_tests/{}'.format(run_id)
-        return self.send_get(uri)
+        return self.send_get_pages(uri, 'tests')
 
     def get_test(self, test_id):
         uri = 'get_test/{}'.format(test_id)
         return self.send_get(uri)
 
-    def add_result(self, test_id, result_id, elapsed=None, comment=None, version=None, defects=None):
+    def add_result(self, test_id, result_id, elapsed=None, comment=None, version=None, defects=None, custom_fields=None):
         uri = 'add_result/{}'.format(test_id)
         data = {'status_id': result_id}
         if elapsed is not None:
@@ -222,9 +433,13 @@ class TestRailAPIClient:
             data['version'] = version
         if defects is not None:
             data['defects'] = defects
+        if custom_fields:
+            # e.g. {'custom_step_results': [...]}
+            data.update(custom_fields)
         return self.send_post(uri, data)
 
-    def add_result_for_case(self, run_id, case_id, result_id, elapsed=None, comment=None, version=None, defects=None):
+    def add_result_for_case(self, run_id, case_id, result_id, elapsed=None, comment=None, version=None, defects=None,
+            custom_fields=None):
         uri = 'add_result_for_case/{}/{}'.format(run_id, case_id)
         data = {'status_id': result_id}
         if elapsed is not None:
@@ -235,11 +450,37 @@ class TestRailAPIClient:
             data['version'] = version
         if defects is not None:
             data['defects'] = defects
+        if custom_fields:
+            # e.g. {'custom_step_results': [...]}
+            data.update(custom_fields)
         return self.send_post(uri, data)
 
+    def add_results_for_cases(self, run_id, results):
+        # results is a list of dicts. each has 'case_id' and 'status_id' and optionally
+        # 'elapsed', 'comment', 'version', 'defects', and custom fields, e.g. 'custom_step_results'.
+        # None values are not sent.
+        uri = 'add_results_for_cases/{}'.format(run_id)
+        data = {'results': []}
+        for r in results:
+            data['results'].append(dict((k, v) for k, v in r.items() if v is not None))
+        return self.send_post(uri, data)
+
+    def get_results_for_run(self, run_id, created_after=None):
+        return list(self.iter_results_for_run(run_id, created_after=created_after))
+
+    def iter_results_for_run(self, run_id, created_after=None):
+        uri = 'get_results_for_run/{}'.format(run_id)
+        if created_after is not None:
+            # UNIX timestamp
+            uri = '{}&created_after={}'.format(uri, int(created_after))
+        return self.send_get_pages(uri, 'results')
+
     def get_suites(self, project_id):
+        return list(self.iter_suites(project_id))
+
+    def iter_suites(self, project_id):
         uri = 'get_suites/{}'.format(project_id)
-        return self.send_get(uri)
+        return self.send_get_pages(uri, 'suites')
 
     def get_suite(self, suite_id):
         uri = 'get_suite/{}'.format(suite_id)
@@ -253,8 +494,11 @@ class TestRailAPIClient:
         return self.send_post(uri, data)
 
     def get_sections(self, project_id, suite_id):
+        return list(self.iter_sections(project_id, suite_id))
+
+    def iter_sections(self, project_id, suite_id):
         uri = 'get_sections/{}&suite_id={}'.format(project_id, suite_id)
-        return self.send_get(uri)
+        return self.send_get_pages(uri, 'sections')
 
     def get_section(self, suite_id):
         uri = 'get_section/{}'.format(suite_id)
@@ -269,6 +513,14 @@ class TestRailAPIClient:
             data['description'] = description
         return self.send_post(uri, data)
 
+    def add_attachment_to_result(self, result_id, path):
+        uri = 'add_attachment_to_result/{}'.format(result_id)
+        return self.send_attachment(uri, path)
+
+    def add_attachment_to_run(self, run_id, path):
+        uri = 'add_attachment_to_run/{}'.format(run_id)
+        return self.send_attachment(uri, path)
+
     def get_automated_test_case_type(self):
         uri = 'get_case_types'
         response = self.send_get(uri)
@@ -277,11 +529,17 @@ class TestRailAPIClient:
                 return tc_type['id']
         raise TestRailAPIError(99, "'Automated' testcase type not found'")
 
-    def get_cases(self, project_id, suite_id, section_id=None):
+    def get_cases(self, project_id, suite_id, section_id=None, updated_after=None):
+        return list(self.iter_cases(project_id, suite_id, section_id=section_id, updated_after=updated_after))
+
+    def iter_cases(self, project_id, suite_id, section_id=None, updated_after=None):
         uri = 'get_cases/{}&suite_id={}'.format(project_id, suite_id)
         if section_id:
             uri = '{}&section_id={}'.format(uri, section_id)
-        return self.send_get(uri)
+        if updated_after is not None:
+            # UNIX timestamp
+            uri = '{}&updated_after={}'.format(uri, int(updated_after))
+        return self.send_get_pages(uri, 'cases')
 
     def add_case(self, section_id, title, type_id):
         uri = 'add_case/{}'.format(section_id)
@@ -290,13 +548,165 @@ class TestRailAPIClient:
 
     def get_user_id(self, user):
         uri = 'get_users'
-        users = self.send_get(uri)
-        for u in users:
+        for u in self.send_get_pages(uri, 'users'):
             if user == u['name'] or user == u['email']:
                 return u['id']
         raise TestRailAPIError(99, '[{}] not found'.format(user))
 
 
+def gzip_encode(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def gzip_decode(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+def _connection_dropped(sock):
+    # an idle connection is only readable if the server closed it
+    try:
+        return bool(select.select([sock], [], [], 0)[0])
+    except (select.error, ValueError):
+        return True
+
+
+class MultipartFile(object):
+
+    '''
+    multipart/form-data body of one file, read from disk as httplib sends it.  seek(0) starts
+    it again for a retry.
+    '''
+
+
+    def __init__(self, path, field='attachment'):
+        boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary={}'.format(boundary)
+        self._head = ('--{}\r\nContent-Disposition: form-data; name="{}"; filename="{}"\r\n'
+                'Content-Type: application/octet-stream\r\n\r\n').format(boundary, field, os.path.basename(path).replace('"', ''))
+        self._tail = '\r\n--{}--\r\n'.format(boundary)
+        self._path = path
+        self._size = os.path.getsize(path)
+        self._parts = []
+        self.seek(0)
+
+    def __len__(self):
+        return len(self._head) + self._size + len(self._tail)
+
+    def seek(self, offset):
+        self.close()
+        self._parts = [StringIO.StringIO(self._head), open(self._path, 'rb'), StringIO.StringIO(self._tail)]
+
+    def read(self, size=-1):
+        chunks = []
+        while self._parts and size != 0:
+            chunk = self._parts[0].read(size)
+            if not chunk:
+                self._parts.pop(0).close()
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return ''.join(chunks)
+
+    def close(self):
+        for part in self._parts:
+            part.close()
+        self._parts = []
+
+
+class TokenBucket(object):
+
+    '''
+    Pace callers of acquire() to rate_per_minute.  Up to burst calls are let through at once
+    after the bucket has been idle.
+    '''
+
+
+    def __init__(self, rate_per_minute, burst=1):
+        self._rate = rate_per_minute / 60.0
+        self._capacity = float(max(1, burst))
+        self._tokens = self._capacity
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self._capacity, self._tokens + (now - self._last) * self._rate)
+            self._last = now
+            # take token now. if bucket is empty caller waits until its token has been added.
+            self._tokens -= 1
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ConnectionPool(object):
+
+    '''
+    Pool of persistent HTTP(S) connections to one server.
+
+    At most size connections are in use at once.  get() waits for one to be put back.
+
+    If the environment has a proxy for protocol, e.g. HTTPS_PROXY, and NO_PROXY does not bypass it
+    for host, connections are to the proxy.  HTTP requests are sent to it with url_prefix on their
+    path and the proxy credentials in headers.  HTTPS connections are tunneled through it.
+    '''
+
+
+    def __init__(self, protocol, host, size=4, timeout=None):
+        if protocol == 'https':
+            self._connection_class = httplib.HTTPSConnection
+        else:
+            self._connection_class = httplib.HTTPConnection
+        self._host = host
+        self._timeout = timeout
+        self._idle = Queue.LifoQueue()
+        self._slots = threading.Semaphore(max(1, size))
+
+        # prefix of request paths and headers of each request. set for HTTP proxy.
+        self.url_prefix = ''
+        self.headers = {}
+        self._tunnel = None
+        proxy = urllib.getproxies().get(protocol)
+        if proxy and not urllib.proxy_bypass(host):
+            if '://' not in proxy:
+                proxy = 'http://' + proxy
+            proxy = urlparse.urlparse(proxy)
+            proxy_headers = {}
+            if proxy.username:
+                proxy_headers['Proxy-Authorization'] = 'Basic {}'.format(base64.b64encode('{}:{}'.format(
+                        urllib.unquote(proxy.username), urllib.unquote(proxy.password or ''))))
+            self._host = '{}:{}'.format(proxy.hostname, proxy.port or 80)
+            if protocol == 'https':
+                self._tunnel = (host, proxy_headers)
+            else:
+                self.url_prefix = 'http://{}'.format(host)
+                self.headers = proxy_headers
+
+    def get(self):
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except Queue.Empty:
+            if self._timeout is None:
+                conn = self._connection_class(self._host)
+            else:
+                conn = self._connection_class(self._host, timeout=self._timeout)
+            if self._tunnel is not None:
+                conn.set_tunnel(self._tunnel[0], headers=self._tunnel[1])
+            return conn
+
+    def put(self, conn, reusable=True):
+        # connections that cannot be reused are closed and a new one is opened next time
+        if reusable:
+            self._idle.put(conn)
+        else:
+            conn.close()
+        self._slots.release()
+
+
 class TestRailAPIError(Exception):
 
 
@@ -304,3 +714,10 @@ class TestRailAPIError(Exception):
         self.code = code
         self.error = error
 
+
+class RequestNotSentError(socket.error):
+
+    '''
+    Connection error before the whole request was sent, so TR did not get it.  Any request,
+    including POSTs that are not idempotent, can be sent again.
+    '''
@@ -0,0 +1,159 @@
+import hashlib
+import os
+import threading
+import Queue
+
+from TestRailAPIClient import TestRailAPIError
+
+
+class AttachmentUploader(object):
+
+    '''
+    Upload files to TR Results and Runs from a background thread so RF tests do not wait on them.
+
+    Files of a Result are given with expect() before the Result is added to the ResultUploader.
+    The ResultUploader calls results_sent() with the IDs TestRail gave the Results, and the files
+    are then queued for upload.
+
+    Files are streamed from disk.  A file with the same content as one already uploaded in this run
+    is not uploaded again.  Once max_bytes have been uploaded no more files are, so a cascade of
+    failures cannot saturate the link.  If the queue is full files are dropped instead of making
+    RF wait.  Files not uploaded are listed in the summary returned by close().
+    '''
+
+    _STOP = object()
+    _CHUNK_SIZE = 64 * 1024
+
+
+    def __init__(self, testrail, logger, max_bytes=50 * 1024 * 1024, queue_size=100, timeout=300):
+        self.testrail = testrail
+        self.logger = logger
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+
+        self.uploaded = 0
+        self.uploaded_bytes = 0
+        self.duplicates = 0
+        # (path, reason) of files not uploaded
+        self.skipped = []
+
+        # files waiting on their Result to be sent. (result, paths, label) by id of Result dict.
+        # Result is kept so its id is not reused while it waits.
+        self._pending = {}
+        self._lock = threading.Lock()
+        # label of first upload of each file content by hash
+        self._hashes = {}
+
+        self._queue = Queue.Queue(maxsize=queue_size)
+        self._worker = threading.Thread(target=self._run, name='TestRailAttachmentUploader')
+        # do not let a hung TR connection keep RF from exiting
+        self._worker.daemon = True
+        self._worker.start()
+
+    def expect(self, result, paths, label=''):
+        # attach files at paths to TR Result dict once it is sent
+        if paths:
+            with self._lock:
+                self._pending[id(result)] = (result, list(paths), label)
+
+    def results_sent(self, results, responses=None):
+        '''
+        Queue files of Result dicts that TestRail accepted.  responses are the TR Results returned
+        for them, in the same order, or None if they failed.
+        '''
+        for i, result in enumerate(results):
+            with self._lock:
+                pending = self._pending.pop(id(result), None)
+            if pending is None:
+                continue
+            _, paths, label = pending
+            for path in paths:
+                if responses is None:
+                    self.skipped.append((path, 'Result not uploaded'))
+                else:
+                    self._put(('result', responses[i]['id'], path, label))
+
+    def add_to_run(self, run_id, path, label=''):
+        self._put(('run', run_id, path, label))
+
+    def close(self):
+        '''
+        Wait for queued files to be uploaded.  Returns summary message of upload.
+        '''
+        self._queue.put(self._STOP)
+        self._worker.join(self.timeout)
+        unsent = []
+        if self._worker.is_alive():
+            # worker did not finish in time. whatever is still on the queue is not sent.
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except Queue.Empty:
+                    break
+                if item is not self._STOP:
+                    unsent.append((item[2], 'not sent in {} secs'.format(self.timeout)))
+        with self._lock:
+            for _, paths, _ in self._pending.values():
+                unsent.extend((path, 'Result not sent') for path in paths)
+            self._pending.clear()
+
+        skipped = self.skipped + unsent
+        msg = u'\nTestrail attachments: {} uploaded ({} KB), {} duplicates not uploaded, {} skipped\n'.format(
+                self.uploaded, self.uploaded_bytes // 1024, self.duplicates, len(skipped))
+        for path, reason in skipped:
+            msg += u' - skipped: {} ({})\n'.format(path, reason)
+        return msg
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except Queue.Full:
+            self.skipped.append((item[2], 'upload queue full'))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                return
+            try:
+                self._upload(*item)
+            except Exception as e:
+                # network errors etc. worker must not die or queue will never empty
+                self.skipped.append((item[2], repr(e)))
+
+    def _upload(self, entity, entity_id, path, label):
+        try:
+            size = os.path.getsize(path)
+            digest = _file_hash(path, self._CHUNK_SIZE)
+        except (IOError, OSError) as e:
+            self.skipped.append((path, str(e)))
+            return
+        if digest in self._hashes:
+            self.duplicates += 1
+            self.logger.log(u'Testrail attachment {} of {} is the same as the one of {}\n'.format(
+                    os.path.basename(path), label, self._hashes[digest]))
+            return
+        if self.uploaded_bytes + size > self.max_bytes:
+            self.skipped.append((path, 'over {} bytes uploaded in run'.format(self.max_bytes)))
+            return
+        try:
+            if 'run' == entity:
+                self.testrail.add_attachment_to_run(entity_id, path)
+            else:
+                self.testrail.add_attachment_to_result(entity_id, path)
+        except TestRailAPIError as e:
+            self.skipped.append((path, '{}: {}'.format(e.code, e.error)))
+            self.logger.log(u'\tLISTENER ERROR: add attachment error: [{}: {}] ({})\n'.format(e.code, e.error, path), console=True)
+            return
+        self._hashes[digest] = label
+        self.uploaded += 1
+        self.uploaded_bytes += size
+
+
+def _file_hash(path, chunk_size):
+    # sha1 of file read a chunk at a time
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
@@ -0,0 +1,185 @@
+#
+# Benchmark of the overhead the Listeners add to robot runs.
+#
+# A synthetic RF suite tree is run against the fake TestRail server in TestRailFakeServer.py:
+#
+#   1. robot --dryrun with TestRailCasesListener to create the TR Suite, Sections, and Cases
+#   2. robot with TestRailRunListener to add the Run and its Results
+#
+# Each is compared to the same robot run without a Listener. Wall clock overhead, requests,
+# and bytes sent to and received from TestRail are reported.
+#
+# Usage:
+#
+#   python TestRailBenchmark.py --tests 10 100 1000 10000 --latency 0.02
+#   python TestRailBenchmark.py --tests 1000 --setting TESTRAIL_BATCH_SIZE=100 --setting TESTRAIL_PREFETCH=True
+#
+# Robot Framework must be installed for the python running the benchmark.
+#
+import argparse
+import ast
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from TestRailFakeServer import start_server
+
+
+SERVER_PY = '''
+# generated by TestRailBenchmark.py
+def get_testrail_srv_info():
+    return {srv_info!r}
+
+
+def set_testrail_names(logger):
+    return 'Benchmark', 'Benchmark Plan', 'Benchmark Run'
+'''
+
+
+def build_suite_tree(root, tests, fanout, depth):
+    '''
+    Write RF suite tree of directories fanout wide and depth deep. Leaf suites are .robot files
+    that together have tests RF tests which pass or fail.
+    '''
+    leaves = [[]]
+    for _ in range(depth):
+        leaves = [path + ['Suite {}'.format(i)] for path in leaves for i in range(fanout)]
+    per_leaf = max(1, -(-tests // len(leaves)))
+    count = 0
+    for path in leaves:
+        if count >= tests:
+            break
+        leaf_dir = os.path.join(root, *path)
+        if not os.path.isdir(leaf_dir):
+            os.makedirs(leaf_dir)
+        lines = ['*** Test Cases ***']
+        for _ in range(min(per_leaf, tests - count)):
+            count += 1
+            lines.append('Test {}'.format(count))
+            # one in ten tests fail
+            lines.append('    Should Be True    {} % 10'.format(count))
+        with open(os.path.join(leaf_dir, 'Leaf.robot'), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+def run_robot(work_dir, suite_dir, listener=None, dryrun=False):
+    # returns wall clock secs of robot run. console output is kept in outputdir
+    output_dir = os.path.join(work_dir, 'output')
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    cmd = [sys.executable, '-m', 'robot', '--pythonpath', work_dir,
+           '--pythonpath', os.path.dirname(os.path.abspath(__file__)),
+           '--outputdir', output_dir, '--output', 'NONE', '--log', 'NONE', '--report', 'NONE',
+           '--console', 'dotted']
+    if listener:
+        cmd.extend(['--listener', listener])
+    if dryrun:
+        cmd.append('--dryrun')
+    cmd.append(suite_dir)
+    console = os.path.join(output_dir, 'console_{}{}.txt'.format(listener or 'baseline', '_dryrun' if dryrun else ''))
+    with open(console, 'w') as f:
+        start = time.time()
+        subprocess.call(cmd, stdout=f, stderr=subprocess.STDOUT)
+        return time.time() - start
+
+
+def benchmark(tests, args, settings):
+    '''
+    Run the Listeners for one size of RF suite tree against a new fake TestRail.
+    Returns list of result dicts.
+    '''
+    server = start_server(latency=args.latency, rate_limit=args.rate_limit, page_size=args.page_size)
+    work_dir = tempfile.mkdtemp(prefix='tr_bench_')
+    try:
+        srv_info = {
+            'TESTRAIL_SERVER': '127.0.0.1:{}'.format(server.server_port),
+            'TESTRAIL_PROTOCOL': 'http',
+            'TESTRAIL_PROJECT_ID': 1,
+            'TESTRAIL_USER': 'listener@example.com',
+            'TESTRAIL_PW': 'benchmark',
+        }
+        srv_info.update(settings)
+        with open(os.path.join(work_dir, 'TestRailServer.py'), 'w') as f:
+            f.write(SERVER_PY.format(srv_info=srv_info))
+        suite_dir = os.path.join(work_dir, 'Benchmark')
+        build_suite_tree(suite_dir, tests, args.fanout, args.depth)
+
+        results = []
+        for listener, dryrun in (('TestRailCasesListener', True), ('TestRailRunListener', False)):
+            baseline = run_robot(work_dir, suite_dir, dryrun=dryrun)
+            server.testrail.reset_stats()
+            wall = run_robot(work_dir, suite_dir, listener=listener, dryrun=dryrun)
+            stats = dict(server.testrail.stats)
+            results.append({
+                'tests': tests,
+                'listener': listener,
+                'wall': wall,
+                'baseline': baseline,
+                'overhead': wall - baseline,
+                'requests': stats['requests'],
+                # as sent on the wire, gzipped if negotiated
+                'bytes_in': stats['wire_bytes_in'],
+                'bytes_out': stats['wire_bytes_out'],
+                'json_bytes_in': stats['bytes_in'],
+                'json_bytes_out': stats['bytes_out'],
+                'rate_limited': stats['rate_limited'],
+                'methods': stats['methods'],
+            })
+        return results
+    finally:
+        server.shutdown()
+        server.server_close()
+        if args.keep:
+            print('Kept {}'.format(work_dir))
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def report(results):
+    header = '{:>7} {:<22} {:>9} {:>9} {:>9} {:>11} {:>9} {:>12} {:>12} {:>6}'.format(
+            'tests', 'listener', 'wall s', 'base s', 'over s', 'over ms/t', 'requests', 'bytes sent', 'bytes recv', '429s')
+    lines = [header, '-' * len(header)]
+    for r in results:
+        lines.append('{:>7} {:<22} {:>9.2f} {:>9.2f} {:>9.2f} {:>11.2f} {:>9} {:>12} {:>12} {:>6}'.format(
+                r['tests'], r['listener'], r['wall'], r['baseline'], r['overhead'],
+                1000.0 * r['overhead'] / r['tests'], r['requests'], r['bytes_in'], r['bytes_out'], r['rate_limited']))
+    return '\n'.join(lines)
+
+
+def parse_setting(setting):
+    # KEY=VALUE. VALUE is a python literal or else a string
+    key, _, value = setting.partition('=')
+    try:
+        value = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        pass
+    return key, value
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark Listener overhead against a fake TestRail')
+    parser.add_argument('--tests', type=int, nargs='+', default=[10, 100, 1000],
+            help='sizes of RF suite trees to run')
+    parser.add_argument('--fanout', type=int, default=4, help='sub suites per suite')
+    parser.add_argument('--depth', type=int, default=2, help='levels of sub suites')
+    parser.add_argument('--latency', type=float, default=0.02, help='secs added to each TestRail request')
+    parser.add_argument('--rate-limit', type=int, default=None, help='max TestRail requests per minute')
+    parser.add_argument('--page-size', type=int, default=250, help='max entries per page of bulk GETs')
+    parser.add_argument('--setting', action='append', default=[],
+            help='optional Listener setting KEY=VALUE as in get_testrail_srv_info()')
+    parser.add_argument('--json', help='also write results to this file')
+    parser.add_argument('--keep', action='store_true', help='keep generated suites and Listener logs')
+    args = parser.parse_args()
+
+    settings = dict(parse_setting(s) for s in args.setting)
+    results = []
+    for tests in args.tests:
+        results.extend(benchmark(tests, args, settings))
+    print(report(results))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -1,9 +1,35 @@
 from TestRailAPIClient import TestRailAPIError
+from TestRailConcurrent import ConcurrentTestRailClient
 from TestRailListener import TestRailListener
+from TestRailSuiteIndex import SuiteCache
+from TestRailSuiteIndex import SuiteIndex
 
 
 class TestRailCasesListener(TestRailListener):
 
+    '''
+    Use Robot Framework's (RF) Listener interface to add TestRail (TR) Cases from a dry run of RF tests.
+
+    RF Listener events:
+
+    start_suite():
+        Get or create TR Test Suite on first RF suite, otherwise get or create TR section of RF suite.
+        Push RF suite name and TR section ID to queue.
+
+        If TESTRAIL_PREFETCH is set all TR Sections and Cases of the Test Suite are got on first RF suite.
+        The sections of all RF suites of the run are then found or created, a level of the suite tree
+        at a time with the sections of a level created concurrently.
+
+    start_test():
+        Queue TR Case to be created if RF test title is not in TR section. Titles of a TR section are
+        got from TR once, on first RF test of the section.
+
+    end_suite():
+        Create queued TR Cases of suite. Up to TESTRAIL_CONCURRENCY are created at once. Pop suite from queue.
+
+    close():
+        Close log if enabled.
+    '''
 
     ROBOT_LISTENER_API_VERSION = 2
 
@@ -16,10 +42,28 @@ class TestRailCasesListener(TestRailListener):
         # by default a TR Test Suites will be created if it does not exist
         self.create_testrail_testsuite = True
 
+        # index of all TR Sections and Cases in Test Suite and TR section ID of each RF suite
+        # path found or created at first suite. set if prefetch is enabled.
+        self.prefetch = self.srv_info.get('TESTRAIL_PREFETCH', False)
+        self.suite_index = None
+        self.section_paths = {}
+
+        # titles of TR Cases in each TR section stored by [section_id]
+        self.section_titles = {}
+        # TR Cases to be created at end of suite. list of (section ID, title, RF test path)
+        self.pending_cases = []
+        # TR Cases are created this many at once. note TR orders Cases of a section in the order
+        # they are created so with more than 1 they may not be in the order of the RF tests.
+        self.concurrency = self.srv_info.get('TESTRAIL_CONCURRENCY', 4)
+        self.concurrent = ConcurrentTestRailClient(self.testrail, self.concurrency)
+
     def start_suite(self, name, attrs):
         if 's1' == attrs['id']:
             self.logger.open(self.logname)
+            self.lookups.start()
             tr_section_id, msg = self.init_testrail_testsuite(name)
+            if self.prefetch:
+                self.init_testrail_sections()
         else:
             tr_section_id, msg = self.init_testrail_section(name)
         self.logger.log(msg)
@@ -28,30 +72,61 @@ class TestRailCasesListener(TestRailListener):
     def start_test(self, name, attrs):
         # last ID appended is the TR Section ID for this RF test
         section_id = self.suite_queue.current_id()
+        rf_test_path = '{}.{}'.format(self.suite_queue.current_path(), name)
 
         # ensure this RF test case does not already exist in TR
-        try:
-            cases = self.testrail.get_cases(self.project_id, self.testsuite_id, section_id)
-        except TestRailAPIError as e:
-            # log but do not quit.
-            self.logger.log('{}.{}\n'.format(self.suite_queue.current_path(), name))
-            self.logger.log('\tLISTENER ERROR: get test cases error: {}: {}\n'.format(e.code, e.error))
+        if section_id not in self.section_titles and self.suite_index is not None:
+            # all TR Cases were got at first suite
+            self.section_titles[section_id] = set()
+        if self.suite_index is not None and self.suite_index.case_id(section_id, name) is not None:
+            self.logger.log('{}\n'.format(rf_test_path))
             return
-        for c in cases:
-            if name == c['title']:
-                # it exists; do not create a new TR Case
-                self.logger.log('{}.{}\n'.format(self.suite_queue.current_path(), name))
+        if section_id not in self.section_titles:
+            try:
+                self.section_titles[section_id] = set(c['title'] for c in
+                        self.testrail.iter_cases(self.project_id, self.testsuite_id, section_id))
+            except TestRailAPIError as e:
+                # log but do not quit.
+                self.logger.log('{}\n'.format(rf_test_path))
+                self.logger.log('\tLISTENER ERROR: get test cases error: {}: {}\n'.format(e.code, e.error))
                 return
+        if name in self.section_titles[section_id]:
+            # it exists; do not create a new TR Case
+            self.logger.log('{}\n'.format(rf_test_path))
+            return
+
+        # create TR Case in current TR section at end of suite
+        self.section_titles[section_id].add(name)
+        self.pending_cases.append((section_id, name, rf_test_path))
+
+    def end_suite(self, name, attrs):
+        self.add_pending_testrail_cases()
+        super(TestRailCasesListener, self).end_suite(name, attrs)
 
-        # create TR Case in current TR section
+    def close(self):
+        self.concurrent.close()
+        super(TestRailCasesListener, self).close()
+
+    def add_pending_testrail_cases(self):
+        # create queued TR Cases. up to concurrency at once.
+        if not self.pending_cases:
+            return
+        pending, self.pending_cases = self.pending_cases, []
         try:
-            resp = self.testrail.add_case(section_id, name, self.auto_type)
+            auto_type = self.auto_type
         except TestRailAPIError as e:
-            # log but do not quit.
-            self.logger.log('{}.{}\n'.format(self.suite_queue.current_path(), name))
-            self.logger.log('\tLISTENER ERROR: add test case error: [{}: {}]\n'.format(e.code, e.error))
-            return
-        self.logger.log('{}.{} - created ({})\n'.format(self.suite_queue.current_path(), name, resp['id']))
+            responses = [e] * len(pending)
+        else:
+            responses = self.concurrent.gather([self.concurrent.add_case(section_id, title, auto_type)
+                    for section_id, title, _ in pending], return_exceptions=True)
+        for (section_id, title, rf_test_path), resp in zip(pending, responses):
+            if isinstance(resp, TestRailAPIError):
+                # log but do not quit.
+                self.logger.log('{}\n'.format(rf_test_path))
+                self.logger.log('\tLISTENER ERROR: add test case error: [{}: {}]\n'.format(resp.code, resp.error))
+                self.section_titles[section_id].discard(title)
+            else:
+                self.logger.log('{} - created ({})\n'.format(rf_test_path, resp['id']))
 
     def end_test(self, name, attrs):
         # override base object behavior of logging test result
@@ -86,7 +161,45 @@ class TestRailCasesListener(TestRailListener):
                 rf_top_level_suite_name, rf_top_level_suite_name, created)
         return self.testsuite_id, msg
 
+    def init_testrail_sections(self):
+        # get all TR Sections and Cases of Test Suite. then find or create TR sections of all RF suites
+        # in this run. sections of a level of the RF suite tree are created concurrently.
+        cache = None
+        if self.srv_info.get('TESTRAIL_CACHE_DIR'):
+            cache = SuiteCache(self.srv_info['TESTRAIL_CACHE_DIR'], self.testrail_server, self.project_id,
+                    self.testsuite_id, max_age=self.srv_info.get('TESTRAIL_CACHE_MAX_AGE', 86400))
+        self.suite_index = SuiteIndex()
+        try:
+            self.suite_index.load(self.testrail, self.project_id, self.testsuite_id, cache=cache)
+        except TestRailAPIError as e:
+            self.logger.log('LISTENER FATAL ERROR: prefetch sections and cases error: {}: {}\n'.format(e.code, e.error), console=True)
+            self.signal_quit()
+
+        rf_suite = self.get_rf_suite_model()
+        if rf_suite is None:
+            # sections are found or created as each RF suite is run
+            return
+        rf_suite_paths = []
+        queue = [((s.name,), s) for s in rf_suite.suites]
+        while queue:
+            path, suite = queue.pop()
+            rf_suite_paths.append(path)
+            queue.extend((path + (s.name,), s) for s in suite.suites)
+        try:
+            self.section_paths, created = self.suite_index.materialize_sections(self.concurrent, self.project_id,
+                    self.testsuite_id, rf_suite_paths)
+        except TestRailAPIError as e:
+            self.logger.log('LISTENER FATAL ERROR: add section error: {}: {}\n'.format(e.code, e.error), console=True)
+            self.signal_quit()
+        self.logger.log(' - Found {} and created {} Testrail sections\n'.format(
+                len(self.section_paths) - len(created), len(created)))
+
     def init_testrail_section(self, rf_suite_name):
+        # section may have been found or created at first suite
+        rf_suite_path = self.suite_queue.current_names()[1:] + (rf_suite_name,)
+        if rf_suite_path in self.section_paths:
+            return self.section_paths[rf_suite_path], '{}.{}\n'.format(self.suite_queue.current_path(), rf_suite_name)
+
         # last TR section ID pushed to suite queue is the parent of this RF suite name being processed.
         # but if that ID is also the testrail testsuite ID then this section has no parent id to be 
         # found or created under.
@@ -94,21 +207,22 @@ class TestRailCasesListener(TestRailListener):
         if cur_parent_id == self.testsuite_id:
             cur_parent_id = None
 
-        # get all sections in testsuite
-        try:
-            tr_sections = self.testrail.get_sections(self.project_id, self.testsuite_id)
-        except TestRailAPIError as e:
-            self.logger.log('LISTENER FATAL ERROR: get sections error: {}: {}\n'.format(e.code, e.error), console=True)
-            self.signal_quit()
-
+        # get all sections in testsuite.
         # find current section ID if it exists ensuring parent_id is correct.
         # tr_section['parent_id'] will be None if this is a top-level TR section.
         # this is so sections with the same name but in different places do not get
         # used just becasue they were seen first.
         tr_section_id = None
-        for tr_section in tr_sections:
-            if rf_suite_name == tr_section['name'] and cur_parent_id == tr_section['parent_id']:
-                tr_section_id = tr_section['id']
+        if self.suite_index is not None:
+            tr_section_id = self.suite_index.section_id(cur_parent_id, rf_suite_name)
+        else:
+            try:
+                for tr_section in self.testrail.iter_sections(self.project_id, self.testsuite_id):
+                    if rf_suite_name == tr_section['name'] and cur_parent_id == tr_section['parent_id']:
+                        tr_section_id = tr_section['id']
+            except TestRailAPIError as e:
+                self.logger.log('LISTENER FATAL ERROR: get sections error: {}: {}\n'.format(e.code, e.error), console=True)
+                self.signal_quit()
 
         # create TR section in TR Test Suite if not found
         created = ''
@@ -120,6 +234,8 @@ class TestRailCasesListener(TestRailListener):
                 self.logger.log('LISTENER FATAL ERROR: add section error: {}: {}\n'.format(e.code, e.error), console=True)
                 self.signal_quit()
             tr_section_id = resp['id']
+            if self.suite_index is not None:
+                self.suite_index.add_section(resp)
             created = ' - created ({})'.format(tr_section_id)
         return tr_section_id, '{}.{}{}\n'.format(self.suite_queue.current_path(), rf_suite_name, created)
 
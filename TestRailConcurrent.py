@@ -0,0 +1,92 @@
+import threading
+from multiprocessing.pool import ThreadPool
+
+from TestRailAPIClient import TestRailAPIClient
+from TestRailAPIClient import TestRailAPIError
+
+
+class ConcurrentTestRailClient(object):
+
+    '''
+    Fan out independent TR api calls.  Has the methods of TestRailAPIClient but each call is
+    started on a thread pool and returns a TestRailCall at once.  gather() waits for a list of them:
+
+        client = ConcurrentTestRailClient(testrail, concurrency=8)
+        cases = client.gather([client.get_cases(project_id, suite_id, s) for s in section_ids])
+
+    Up to concurrency calls are sent at once and the rest wait their turn.  Calls are sent by the
+    wrapped client so they share its connection pool, rate limit, retries, and stats.  The pool
+    has at most TESTRAIL_POOL_SIZE connections so concurrency above it only queues calls there.
+    iter_ methods return the whole list as the pages are got on the pool's thread.
+    '''
+
+
+    def __init__(self, testrail, concurrency=4):
+        self.testrail = testrail
+        self.concurrency = max(1, concurrency)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name.startswith('iter_') and hasattr(TestRailAPIClient, name):
+            method = getattr(self.testrail, name)
+            return lambda *args, **kwargs: self.submit(lambda: list(method(*args, **kwargs)))
+        if not name.startswith('_') and hasattr(TestRailAPIClient, name):
+            method = getattr(self.testrail, name)
+            return lambda *args, **kwargs: self.submit(method, *args, **kwargs)
+        raise AttributeError(name)
+
+    def submit(self, func, *args, **kwargs):
+        # run any callable on the pool, e.g. one that makes several dependent calls
+        with self._lock:
+            if self._pool is None:
+                # threads are only started when first needed
+                self._pool = ThreadPool(self.concurrency)
+            return TestRailCall(self._pool.apply_async(func, args, kwargs))
+
+    def gather(self, calls, return_exceptions=False):
+        '''
+        Wait for all calls and return their responses in the same order.  If return_exceptions is
+        True the TestRailAPIError of a failed call is returned in its place, otherwise the first
+        one is raised after all calls are done.
+        '''
+        responses = []
+        first_error = None
+        for call in calls:
+            try:
+                responses.append(call.wait())
+            except TestRailAPIError as e:
+                responses.append(e)
+                first_error = first_error or e
+        if first_error is not None and not return_exceptions:
+            raise first_error
+        return responses
+
+    def map(self, method, args_list, return_exceptions=False):
+        # call method name with each tuple of args. e.g. map('close_run', [(1,), (2,)])
+        return self.gather([getattr(self, method)(*args) for args in args_list], return_exceptions)
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+
+class TestRailCall(object):
+
+    '''
+    TR api call in progress.  wait() returns its response or raises its error.
+    '''
+
+
+    def __init__(self, async_result):
+        self._async_result = async_result
+
+    def done(self):
+        return self._async_result.ready()
+
+    def wait(self, timeout=None):
+        # waits without a timeout cannot be interrupted with ctrl-c in python 2
+        return self._async_result.get(timeout if timeout is not None else 1e9)
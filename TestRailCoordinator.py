@@ -0,0 +1,121 @@
+import contextlib
+import errno
+import hashlib
+import json
+import os
+import time
+import uuid
+
+# file locks are only available on unix
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class RunCoordinator(object):
+
+    '''
+    Share one TR Milestone, Plan, and Run between the Listeners of parallel robot processes,
+    e.g. the processes started by pabot.
+
+    State of the shared Run is a JSON file in a dir all processes can reach.  Two lock files
+    guard it:
+
+        exclusive() is held while a process makes TR api calls that change the shared Run,
+        e.g. adding the Milestone, Plan, or Plan entry.  Other processes wait for it and then
+        use what was added instead of adding their own.
+
+        state() is held only while the state file is read and written.
+
+    Case IDs a process needs in the Run are added to the pending Case IDs of the state before
+    it waits for exclusive().  Whichever process gets it next sends all pending Case IDs in one
+    update of the Plan entry, so processes that wait at the same time share one update.
+
+    key should include an ID of the invocation of the processes so a later one does not use the
+    Run of an earlier one.  Files of Runs not changed for max_age secs are removed.
+    '''
+
+
+    def __init__(self, coordination_dir, key, max_age=7 * 86400):
+        if fcntl is None:
+            raise ValueError('Shared Run needs file locks which are not available on this platform')
+        name = 'tr_run_{}'.format(hashlib.sha1(key.encode('utf-8')).hexdigest()[:16])
+        self.path = os.path.join(coordination_dir, '{}.json'.format(name))
+        self._state_lock = os.path.join(coordination_dir, '{}.lock'.format(name))
+        self._exclusive_lock = os.path.join(coordination_dir, '{}.exclusive.lock'.format(name))
+        if not os.path.isdir(coordination_dir):
+            try:
+                os.makedirs(coordination_dir)
+            except OSError:
+                # made by another process
+                if not os.path.isdir(coordination_dir):
+                    raise
+        _remove_old_files(coordination_dir, max_age)
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        with self._locked(self._exclusive_lock):
+            yield
+
+    @contextlib.contextmanager
+    def state(self):
+        '''
+        Yields state dict of shared Run.  It is saved if the block does not raise.
+        '''
+        with self._locked(self._state_lock):
+            state = {}
+            if os.path.exists(self.path):
+                with open(self.path) as f:
+                    state = json.load(f)
+            yield state
+            # replace file so a process killed while writing does not leave part of it
+            tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.rename(tmp_path, self.path)
+
+    @contextlib.contextmanager
+    def _locked(self, lock_path):
+        # lock is released by the OS if the process dies while holding it
+        with open(lock_path, 'a') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def invocation_id(dir_path):
+    '''
+    ID shared by processes of one invocation that is new for each one, e.g. of pabot, which
+    empties dir_path at its start.  The first process writes a new ID in dir_path and the others
+    read it.
+    '''
+    path = os.path.join(dir_path, 'tr_invocation_id')
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        f.write(uuid.uuid4().hex)
+    try:
+        # link fails if another process wrote the ID first. the file is never seen part written.
+        os.link(tmp_path, path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    finally:
+        os.remove(tmp_path)
+    with open(path) as f:
+        return f.read()
+
+
+def _remove_old_files(coordination_dir, max_age):
+    # state and locks of Runs of earlier invocations are never used again
+    now = time.time()
+    for name in os.listdir(coordination_dir):
+        if name.startswith('tr_run_'):
+            try:
+                if now - os.path.getmtime(os.path.join(coordination_dir, name)) > max_age:
+                    os.remove(os.path.join(coordination_dir, name))
+            except OSError:
+                # removed by another process
+                pass
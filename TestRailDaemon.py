@@ -0,0 +1,288 @@
+#
+# Local daemon that forwards TestRail requests and Results of all Listener processes on a host.
+#
+# The daemon owns one TestRailAPIClient, so one connection pool and one rate limit, a cache of
+# TestRail metadata, and one ResultUploader that sends the Results of all processes in batches.
+# Listeners reach it over a Unix socket when TESTRAIL_DAEMON_SOCKET is set in TestRailServer.py.
+#
+# Usage:
+#
+#   python TestRailDaemon.py [--socket PATH] [--batch-size 100] [--batch-interval 5] [--cache-ttl 300]
+#
+# Messages are lines of JSON.  A request is {"method": name, "args": [...], "kwargs": {...}}
+# and is answered with {"result": value} or {"error": [code, error]}.  Results are sent as
+# {"method": "forward_result", "args": [run_id, result, label]} and are not answered so Listeners
+# do not wait for them.
+#
+import argparse
+import json
+import os
+import signal
+import socket
+import SocketServer
+import sys
+import threading
+import time
+
+from TestRailAPIClient import TestRailAPIClient
+from TestRailAPIClient import TestRailAPIError
+from TestRailResultUploader import ResultUploader
+from TestRailStats import CallStats
+
+
+class TestRailDaemon(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+
+    '''
+    Unix socket server with one thread per connected Listener.
+
+    Requests are methods of TestRailAPIClient.  Metadata that all Listeners of a host ask for,
+    e.g. case types, users, and the Sections and Cases of a Test Suite, is cached for cache_ttl
+    secs.  Concurrent requests for the same metadata wait for one of them to be sent.  Any
+    request that changes TestRail empties the cache.
+    '''
+
+    daemon_threads = True
+
+    # TR api client methods whose responses are cached
+    CACHED_METHODS = frozenset(['get_automated_test_case_type', 'get_user_id', 'get_suites',
+            'get_sections', 'get_cases', 'get_project', 'get_projects'])
+
+
+    def __init__(self, socket_path, testrail, uploader, logger, cache_ttl=300):
+        self.testrail = testrail
+        self.uploader = uploader
+        self.logger = logger
+        self.cache_ttl = cache_ttl
+        self.methods = frozenset(m for m in dir(TestRailAPIClient) if not m.startswith('_'))
+
+        # cached responses by (method, args). each key has a lock so it is only got once at a time.
+        self._cache = {}
+        self._key_locks = {}
+        self._cache_lock = threading.Lock()
+        self.forwarded = 0
+
+        # socket of a daemon that did not exit cleanly is left behind
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        SocketServer.UnixStreamServer.__init__(self, socket_path, DaemonRequestHandler)
+
+    def call(self, method, args, kwargs):
+        if method not in self.methods:
+            raise TestRailAPIError(99, 'Unknown TestRail daemon method [{}]'.format(method))
+        if method not in self.CACHED_METHODS:
+            if not method.startswith('get_'):
+                self.clear_cache()
+            return getattr(self.testrail, method)(*args, **kwargs)
+
+        key = json.dumps([method, args, kwargs], sort_keys=True)
+        with self._cache_lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._cache_lock:
+                cached = self._cache.get(key)
+            if cached is not None and time.time() - cached[0] < self.cache_ttl:
+                return cached[1]
+            value = getattr(self.testrail, method)(*args, **kwargs)
+            with self._cache_lock:
+                self._cache[key] = (time.time(), value)
+            return value
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
+
+    def forward_result(self, run_id, result, label):
+        self.forwarded += 1
+        self.uploader.add(run_id, result, label)
+
+    def sync(self):
+        # queue buffered Results to be sent. returns counts of Results
+        self.uploader.flush()
+        return {'forwarded': self.forwarded, 'uploaded': self.uploader.uploaded, 'failed': len(self.uploader.failed)}
+
+
+class DaemonRequestHandler(SocketServer.StreamRequestHandler):
+
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            msg = json.loads(line)
+            method = msg['method']
+            args = msg.get('args', [])
+            if 'forward_result' == method:
+                self.server.forward_result(*args)
+                continue
+            try:
+                if 'sync' == method:
+                    response = {'result': self.server.sync()}
+                else:
+                    response = {'result': self.server.call(method, args, msg.get('kwargs', {}))}
+            except TestRailAPIError as e:
+                response = {'error': [e.code, e.error]}
+            except Exception as e:
+                # network errors etc. are reported the same way the ResultUploader reports them
+                response = {'error': [99, str(e)]}
+            self.wfile.write(json.dumps(response) + '\n')
+            self.wfile.flush()
+
+
+class TestRailDaemonClient(object):
+
+    '''
+    Thin client used by Listeners in place of TestRailAPIClient when a TestRailDaemon is running.
+
+    Has the methods of TestRailAPIClient.  Each call is sent to the daemon and waits for its
+    response.  iter_ methods get the whole list from the daemon.  Failures to reach the daemon
+    are raised as TestRailAPIError so Listeners handle them as any other TestRail error.
+    '''
+
+
+    def __init__(self, socket_path, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._sock = None
+        self._rfile = None
+        # round trips to daemon by method. time in TestRail is in the stats of the daemon's client.
+        self.stats = CallStats()
+        # RF and ResultUploader threads can share client
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name.startswith('iter_') and hasattr(TestRailAPIClient, 'get_' + name[5:]):
+            return lambda *args, **kwargs: iter(self._call('get_' + name[5:], args, kwargs))
+        if not name.startswith('_') and hasattr(TestRailAPIClient, name):
+            return lambda *args, **kwargs: self._call(name, args, kwargs)
+        raise AttributeError(name)
+
+    def forward_result(self, run_id, result, label=''):
+        # Result is batched and sent by daemon. does not wait for a response.
+        self._send({'method': 'forward_result', 'args': [run_id, result, label]}, response=False)
+
+    def sync(self):
+        return self._send({'method': 'sync'})
+
+    def close(self):
+        with self._lock:
+            if self._sock is not None:
+                self._rfile.close()
+                self._sock.close()
+                self._sock = None
+
+    def _call(self, method, args, kwargs):
+        start = time.time()
+        try:
+            return self._send({'method': method, 'args': list(args), 'kwargs': kwargs})
+        finally:
+            self.stats.record('DAEMON {}'.format(method), time.time() - start)
+
+    def _send(self, msg, response=True):
+        with self._lock:
+            try:
+                if self._sock is None:
+                    self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    self._sock.settimeout(self.timeout)
+                    self._sock.connect(self.socket_path)
+                    self._rfile = self._sock.makefile('rb')
+                self._sock.sendall(json.dumps(msg) + '\n')
+                if not response:
+                    return None
+                line = self._rfile.readline()
+            except socket.error as e:
+                self._sock = None
+                raise TestRailAPIError(99, 'TestRail daemon [{}] error: {}'.format(self.socket_path, e))
+        if not line:
+            self._sock = None
+            raise TestRailAPIError(99, 'TestRail daemon [{}] closed connection'.format(self.socket_path))
+        response = json.loads(line)
+        if 'error' in response:
+            raise TestRailAPIError(*response['error'])
+        return response['result']
+
+
+class ResultForwarder(object):
+
+    '''
+    Has the interface of ResultUploader for Listeners.  Results are forwarded to the TestRailDaemon,
+    which sends them with those of other Listeners.
+    '''
+
+
+    def __init__(self, client):
+        self.client = client
+        self.forwarded = 0
+
+    def add(self, run_id, result, label=''):
+        try:
+            self.client.forward_result(run_id, result, label)
+        except TestRailAPIError as e:
+            return e
+        self.forwarded += 1
+        return None
+
+    def flush(self):
+        # daemon sends batches of Results of all Listeners on its own schedule
+        pass
+
+    def close(self):
+        try:
+            counts = self.client.sync()
+        except TestRailAPIError as e:
+            return '\nTestrail Results: {} forwarded to daemon. daemon error: {}\n'.format(self.forwarded, e.error)
+        finally:
+            self.client.close()
+        return '\nTestrail Results: {} forwarded to daemon. daemon totals: {} forwarded, {} uploaded, {} failed\n'.format(
+                self.forwarded, counts['forwarded'], counts['uploaded'], counts['failed'])
+
+
+class DaemonLogger(object):
+
+
+    def log(self, msg, console=False):
+        sys.stderr.write(msg)
+
+
+def main(cli_args):
+    # import Testrail server info. Listener imports this module for the daemon client.
+    from TestRailListener import create_testrail_client
+    try:
+        from  TestRailServer import get_testrail_srv_info
+    except ImportError as e:
+        raise ValueError('Function not imported from TestRailServer.py.  Error: {}'.format(e))
+    srv_info = get_testrail_srv_info()
+
+    parser = argparse.ArgumentParser(description='Forward TestRail requests and Results of all Listeners on a host')
+    parser.add_argument('--socket', default=srv_info.get('TESTRAIL_DAEMON_SOCKET'),
+            help='path of Unix socket. default is TESTRAIL_DAEMON_SOCKET')
+    parser.add_argument('--batch-size', type=int, default=100, help='max Results sent in one request')
+    parser.add_argument('--batch-interval', type=float, default=5, help='max secs a Result waits in a batch')
+    parser.add_argument('--cache-ttl', type=float, default=300, help='secs metadata is cached')
+    args = parser.parse_args(cli_args)
+    if not args.socket:
+        parser.error('--socket or TESTRAIL_DAEMON_SOCKET is needed')
+
+    # daemon talks to TestRail itself
+    srv_info = dict(srv_info, TESTRAIL_DAEMON_SOCKET=None)
+    testrail = create_testrail_client(srv_info)
+    logger = DaemonLogger()
+    uploader = ResultUploader(testrail, logger, async_mode=True,
+            queue_size=srv_info.get('TESTRAIL_ASYNC_QUEUE_SIZE', 1000),
+            timeout=srv_info.get('TESTRAIL_ASYNC_TIMEOUT', 300),
+            batch_size=args.batch_size, batch_interval=args.batch_interval)
+    server = TestRailDaemon(args.socket, testrail, uploader, logger, cache_ttl=args.cache_ttl)
+
+    # SIGTERM exits as ctrl-c does so buffered Results are sent
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    logger.log('TestRail daemon listening on {}\n'.format(args.socket))
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+        logger.log(uploader.close())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
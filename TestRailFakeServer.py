@@ -0,0 +1,509 @@
+#
+# Local stand-in for a TestRail server.
+#
+# Implements, in memory, the TestRail API v2 methods used by TestRailAPIClient so
+# the Listeners can be run and measured without a real TestRail. Latency and a
+# rate limit can be added to each request. Bulk GETs are paged like TestRail 6.7+.
+#
+# Usage:
+#
+#   python TestRailFakeServer.py --port 8080 --latency 0.05 --rate-limit 180
+#
+# Request counts and bytes received and sent are returned by GET /stats and reset
+# by POST /stats.
+#
+import argparse
+import BaseHTTPServer
+import itertools
+import json
+import math
+import re
+import SocketServer
+import threading
+import time
+import zlib
+
+
+class FakeTestRail(object):
+
+    '''
+    In memory TestRail data and API methods.
+
+    latency       secs each request is delayed before it is answered
+    rate_limit    max requests per minute. more are answered with 429 and Retry-After
+    page_size     max entries per page of bulk GETs. 0 returns all entries as a list like
+                  TestRail before 6.7
+    '''
+
+
+    def __init__(self, user='listener@example.com', latency=0, rate_limit=None, page_size=250):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.page_size = page_size
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._requests = []
+
+        self.users = [{'id': 1, 'name': 'Listener', 'email': user, 'is_active': True}]
+        self.case_types = [{'id': 1, 'name': 'Automated'}, {'id': 2, 'name': 'Other'}]
+        self.projects = {1: {'id': 1, 'name': 'Benchmark', 'suite_mode': 3}}
+        self.suites = {}
+        self.sections = {}
+        self.cases = {}
+        self.milestones = {}
+        self.plans = {}
+        self.runs = {}
+        self.tests = {}
+        # Tests by (run_id, case_id) so Results for Cases are found without a scan of all Tests
+        self.run_tests = {}
+        self.results = {}
+        # uploaded files are only counted. name and size by attachment ID
+        self.attachments = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            # bytes are of request and response json. wire_bytes are as sent, which may be gzipped.
+            self.stats = {'requests': 0, 'bytes_in': 0, 'bytes_out': 0, 'wire_bytes_in': 0, 'wire_bytes_out': 0,
+                          'rate_limited': 0, 'methods': {}}
+
+    def add_wire_bytes(self, bytes_in, bytes_out):
+        with self._lock:
+            self.stats['wire_bytes_in'] += bytes_in
+            self.stats['wire_bytes_out'] += bytes_out
+
+    def request(self, method, path, body, content_type='application/json'):
+        # answer one HTTP request. returns status, list of extra headers, and response body
+        if path == '/stats':
+            if method == 'POST':
+                self.reset_stats()
+            return 200, [], json.dumps(self.stats)
+
+        if '/api/v2/' not in path:
+            return 404, [], json.dumps({'error': 'Unknown path'})
+        uri = path.split('/api/v2/', 1)[1]
+        name = uri.split('/', 1)[0].split('&', 1)[0]
+
+        retry_after = self._rate_limited()
+        if retry_after:
+            with self._lock:
+                self.stats['rate_limited'] += 1
+            return 429, [('Retry-After', str(retry_after))], json.dumps(
+                    {'error': 'API Rate Limit Exceeded - 180 per minute maximum allowed. Retry after {} seconds.'.format(retry_after)})
+        if self.latency:
+            time.sleep(self.latency)
+
+        try:
+            if content_type.startswith('multipart/form-data'):
+                data = self._multipart(body)
+            else:
+                data = json.loads(body) if body else {}
+            with self._lock:
+                status, result = self.call(method, uri, data)
+        except (ValueError, KeyError, TypeError) as e:
+            status, result = 400, {'error': 'Bad request: {}'.format(e)}
+        response = json.dumps(result)
+
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['bytes_in'] += len(body)
+            self.stats['bytes_out'] += len(response)
+            self.stats['methods'][name] = self.stats['methods'].get(name, 0) + 1
+        return status, [], response
+
+    def call(self, method, uri, data):
+        # uri is e.g. get_cases/1&suite_id=2&section_id=3
+        parts = uri.split('&')
+        path = parts[0].split('/')
+        name = path[0]
+        args = [int(a) for a in path[1:] if a]
+        params = dict(p.split('=', 1) for p in parts[1:] if '=' in p)
+        handler = getattr(self, '_{}'.format(name), None)
+        if handler is None:
+            return 400, {'error': 'Unknown method {}'.format(name)}
+        if (method == 'GET') != name.startswith('get_'):
+            return 400, {'error': 'Wrong method {} for {}'.format(method, name)}
+        return handler(uri, args, params, data)
+
+    def _rate_limited(self):
+        # secs to wait if over rate limit, otherwise 0
+        if not self.rate_limit:
+            return 0
+        with self._lock:
+            now = time.time()
+            self._requests = [t for t in self._requests if t > now - 60]
+            if len(self._requests) >= self.rate_limit:
+                return int(math.ceil(self._requests[0] + 60 - now))
+            self._requests.append(now)
+        return 0
+
+    def _multipart(self, body):
+        # name and size of the one file of a multipart/form-data body
+        head, _, content = body.partition('\r\n\r\n')
+        filename = re.search(r'filename="([^"]*)"', head)
+        boundary = head.split('\r\n', 1)[0]
+        content = content[:content.rindex('\r\n' + boundary)]
+        return {'name': filename.group(1) if filename else '', 'size': len(content)}
+
+    def _new_id(self):
+        return next(self._ids)
+
+    def _page(self, uri, key, entries, params):
+        if not self.page_size:
+            return 200, entries
+        offset = int(params.get('offset', 0))
+        limit = min(int(params.get('limit', self.page_size)), self.page_size)
+        page = entries[offset:offset + limit]
+        base = '&'.join(p for p in uri.split('&') if not p.startswith(('offset=', 'limit=')))
+        next_page = None
+        if offset + limit < len(entries):
+            next_page = '/api/v2/{}&limit={}&offset={}'.format(base, limit, offset + limit)
+        return 200, {'offset': offset, 'limit': limit, 'size': len(page),
+                     '_links': {'next': next_page, 'prev': None}, key: page}
+
+    def _not_found(self, what):
+        return 400, {'error': 'Field :{} is not a valid ID.'.format(what)}
+
+    # users and types
+
+    def _get_users(self, uri, args, params, data):
+        return self._page(uri, 'users', self.users, params)
+
+    def _get_case_types(self, uri, args, params, data):
+        return 200, self.case_types
+
+    def _get_project(self, uri, args, params, data):
+        if args[0] not in self.projects:
+            return self._not_found('project_id')
+        return 200, self.projects[args[0]]
+
+    # suites, sections, and cases
+
+    def _get_suites(self, uri, args, params, data):
+        return 200, [s for s in self.suites.values() if s['project_id'] == args[0]]
+
+    def _get_suite(self, uri, args, params, data):
+        if args[0] not in self.suites:
+            return self._not_found('suite_id')
+        return 200, self.suites[args[0]]
+
+    def _add_suite(self, uri, args, params, data):
+        suite = {'id': self._new_id(), 'project_id': args[0], 'name': data['name'],
+                 'description': data.get('description')}
+        self.suites[suite['id']] = suite
+        return 200, suite
+
+    def _get_sections(self, uri, args, params, data):
+        suite_id = int(params['suite_id'])
+        sections = [s for s in sorted(self.sections.values(), key=lambda s: s['id']) if s['suite_id'] == suite_id]
+        return self._page(uri, 'sections', sections, params)
+
+    def _get_section(self, uri, args, params, data):
+        if args[0] not in self.sections:
+            return self._not_found('section_id')
+        return 200, self.sections[args[0]]
+
+    def _add_section(self, uri, args, params, data):
+        if data['suite_id'] not in self.suites:
+            return self._not_found('suite_id')
+        parent_id = data.get('parent_id')
+        if parent_id is not None and parent_id not in self.sections:
+            return self._not_found('parent_id')
+        depth = self.sections[parent_id]['depth'] + 1 if parent_id is not None else 0
+        section = {'id': self._new_id(), 'suite_id': data['suite_id'], 'name': data['name'],
+                   'parent_id': parent_id, 'depth': depth, 'description': data.get('description')}
+        self.sections[section['id']] = section
+        return 200, section
+
+    def _get_cases(self, uri, args, params, data):
+        suite_id = int(params['suite_id'])
+        section_id = int(params['section_id']) if 'section_id' in params else None
+        updated_after = int(params['updated_after']) if 'updated_after' in params else None
+        cases = [c for c in sorted(self.cases.values(), key=lambda c: c['id'])
+                 if c['suite_id'] == suite_id
+                 and (section_id is None or c['section_id'] == section_id)
+                 and (updated_after is None or c['updated_on'] > updated_after)]
+        return self._page(uri, 'cases', cases, params)
+
+    def _get_case(self, uri, args, params, data):
+        if args[0] not in self.cases:
+            return self._not_found('case_id')
+        return 200, self.cases[args[0]]
+
+    def _add_case(self, uri, args, params, data):
+        if args[0] not in self.sections:
+            return self._not_found('section_id')
+        now = int(time.time())
+        case = {'id': self._new_id(), 'section_id': args[0], 'suite_id': self.sections[args[0]]['suite_id'],
+                'title': data['title'], 'type_id': data.get('type_id', 2), 'created_on': now, 'updated_on': now}
+        self.cases[case['id']] = case
+        return 200, case
+
+    # milestones and plans
+
+    def _filter(self, entries, params):
+        # filters common to get_milestones and get_plans
+        if 'is_completed' in params:
+            entries = [e for e in entries if e['is_completed'] == bool(int(params['is_completed']))]
+        if 'created_after' in params:
+            entries = [e for e in entries if e['created_on'] > int(params['created_after'])]
+        if 'milestone_id' in params:
+            ids = [int(i) for i in params['milestone_id'].split(',')]
+            entries = [e for e in entries if e.get('milestone_id') in ids]
+        return entries
+
+    def _get_milestones(self, uri, args, params, data):
+        milestones = [m for m in sorted(self.milestones.values(), key=lambda m: m['id']) if m['project_id'] == args[0]]
+        return self._page(uri, 'milestones', self._filter(milestones, params), params)
+
+    def _get_milestone(self, uri, args, params, data):
+        if args[0] not in self.milestones:
+            return self._not_found('milestone_id')
+        return 200, self.milestones[args[0]]
+
+    def _add_milestone(self, uri, args, params, data):
+        milestone = {'id': self._new_id(), 'project_id': args[0], 'name': data['name'],
+                     'description': data.get('description'), 'is_completed': False, 'created_on': int(time.time())}
+        self.milestones[milestone['id']] = milestone
+        return 200, milestone
+
+    def _update_milestone(self, uri, args, params, data):
+        if args[0] not in self.milestones:
+            return self._not_found('milestone_id')
+        self.milestones[args[0]].update(data)
+        return 200, self.milestones[args[0]]
+
+    def _plan_summary(self, plan):
+        return dict((k, v) for k, v in plan.items() if k != 'entries')
+
+    def _get_plans(self, uri, args, params, data):
+        plans = [self._plan_summary(p) for p in sorted(self.plans.values(), key=lambda p: p['id'])
+                 if p['project_id'] == args[0]]
+        return self._page(uri, 'plans', self._filter(plans, params), params)
+
+    def _get_plan(self, uri, args, params, data):
+        if args[0] not in self.plans:
+            return self._not_found('plan_id')
+        return 200, self.plans[args[0]]
+
+    def _add_plan(self, uri, args, params, data):
+        plan = {'id': self._new_id(), 'project_id': args[0], 'name': data['name'],
+                'milestone_id': data.get('milestone_id'), 'description': data.get('description'),
+                'is_completed': False, 'created_on': int(time.time()), 'entries': []}
+        self.plans[plan['id']] = plan
+        return 200, plan
+
+    def _close_plan(self, uri, args, params, data):
+        if args[0] not in self.plans:
+            return self._not_found('plan_id')
+        self.plans[args[0]]['is_completed'] = True
+        return 200, self.plans[args[0]]
+
+    def _add_plan_entry(self, uri, args, params, data):
+        if args[0] not in self.plans:
+            return self._not_found('plan_id')
+        entry_id = self._new_id()
+        run = {'id': self._new_id(), 'suite_id': data['suite_id'], 'name': data['name'], 'plan_id': args[0],
+               'entry_id': entry_id, 'is_completed': False, 'include_all': data.get('include_all', True),
+               'created_on': int(time.time())}
+        self.runs[run['id']] = run
+        case_ids = data.get('case_ids') if not run['include_all'] else \
+                [c['id'] for c in self.cases.values() if c['suite_id'] == data['suite_id']]
+        error = self._set_run_cases(run, case_ids or [])
+        if error:
+            return error
+        entry = {'id': entry_id, 'suite_id': data['suite_id'], 'name': data['name'], 'runs': [run]}
+        self.plans[args[0]]['entries'].append(entry)
+        return 200, entry
+
+    def _update_plan_entry(self, uri, args, params, data):
+        if args[0] not in self.plans:
+            return self._not_found('plan_id')
+        entries = [e for e in self.plans[args[0]]['entries'] if e['id'] == args[1]]
+        if not entries:
+            return self._not_found('entry_id')
+        entry = entries[0]
+        if 'name' in data:
+            entry['name'] = data['name']
+        if 'case_ids' in data:
+            error = self._set_run_cases(entry['runs'][0], data['case_ids'])
+            if error:
+                return error
+        return 200, entry
+
+    def _set_run_cases(self, run, case_ids):
+        # Tests of Run are replaced by Tests of case_ids. Results of Tests kept are kept.
+        for case_id in case_ids:
+            if case_id not in self.cases:
+                return self._not_found('case_ids')
+        case_ids = set(case_ids)
+        for test in [t for t in self.tests.values() if t['run_id'] == run['id']]:
+            if test['case_id'] not in case_ids:
+                del self.tests[test['id']]
+                del self.run_tests[(run['id'], test['case_id'])]
+            else:
+                case_ids.discard(test['case_id'])
+        for case_id in sorted(case_ids):
+            test = {'id': self._new_id(), 'case_id': case_id, 'run_id': run['id'],
+                    'title': self.cases[case_id]['title'], 'status_id': 3}
+            self.tests[test['id']] = test
+            self.run_tests[(run['id'], case_id)] = test
+        return None
+
+    # runs, tests, and results
+
+    def _get_run(self, uri, args, params, data):
+        if args[0] not in self.runs:
+            return self._not_found('run_id')
+        return 200, self.runs[args[0]]
+
+    def _close_run(self, uri, args, params, data):
+        if args[0] not in self.runs:
+            return self._not_found('run_id')
+        self.runs[args[0]]['is_completed'] = True
+        return 200, self.runs[args[0]]
+
+    def _get_tests(self, uri, args, params, data):
+        tests = [t for t in sorted(self.tests.values(), key=lambda t: t['id']) if t['run_id'] == args[0]]
+        return self._page(uri, 'tests', tests, params)
+
+    def _get_test(self, uri, args, params, data):
+        if args[0] not in self.tests:
+            return self._not_found('test_id')
+        return 200, self.tests[args[0]]
+
+    def _run_test(self, run_id, case_id):
+        return self.run_tests.get((run_id, case_id))
+
+    def _new_result(self, test, data):
+        result = dict(data)
+        result.pop('case_id', None)
+        result.update({'id': self._new_id(), 'test_id': test['id'], 'created_on': int(time.time())})
+        test['status_id'] = data['status_id']
+        self.results[result['id']] = result
+        return result
+
+    def _get_results_for_run(self, uri, args, params, data):
+        if args[0] not in self.runs:
+            return self._not_found('run_id')
+        results = [r for r in sorted(self.results.values(), key=lambda r: r['id'])
+                   if self.tests[r['test_id']]['run_id'] == args[0]]
+        if 'created_after' in params:
+            results = [r for r in results if r['created_on'] > int(params['created_after'])]
+        return self._page(uri, 'results', results, params)
+
+    def _add_attachment_to_result(self, uri, args, params, data):
+        if args[0] not in self.results:
+            return self._not_found('result_id')
+        return 200, self._new_attachment('result', args[0], data)
+
+    def _add_attachment_to_run(self, uri, args, params, data):
+        if args[0] not in self.runs:
+            return self._not_found('run_id')
+        return 200, self._new_attachment('run', args[0], data)
+
+    def _new_attachment(self, entity, entity_id, data):
+        attachment = dict(data, id=self._new_id(), entity=entity, entity_id=entity_id)
+        self.attachments[attachment['id']] = attachment
+        return {'attachment_id': attachment['id']}
+
+    def _add_result(self, uri, args, params, data):
+        if args[0] not in self.tests:
+            return self._not_found('test_id')
+        return 200, self._new_result(self.tests[args[0]], data)
+
+    def _add_result_for_case(self, uri, args, params, data):
+        if args[0] not in self.runs:
+            return self._not_found('run_id')
+        test = self._run_test(args[0], args[1])
+        if test is None:
+            return 400, {'error': 'No (active) test found for the run/case combination.'}
+        return 200, self._new_result(test, data)
+
+    def _add_results_for_cases(self, uri, args, params, data):
+        if args[0] not in self.runs:
+            return self._not_found('run_id')
+        # whole request fails if any Result is for a Case not in Run
+        tests = [self._run_test(args[0], r['case_id']) for r in data['results']]
+        if None in tests:
+            return 400, {'error': 'Field :results cannot be added. No (active) test found for the run/case combination.'}
+        return 200, [self._new_result(t, r) for t, r in zip(tests, data['results'])]
+
+
+class FakeTestRailHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # keep-alive
+    protocol_version = 'HTTP/1.1'
+    # buffer response so it is sent in one write. unbuffered small writes are held back
+    # by Nagle's algorithm until the client's delayed ACK
+    wbufsize = -1
+
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _handle(self, method):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        wire_body = self.rfile.read(length) if length else ''
+        body = wire_body
+        if 'gzip' == self.headers.getheader('Content-Encoding'):
+            body = zlib.decompress(wire_body, 16 + zlib.MAX_WBITS)
+        status, headers, response = self.server.testrail.request(method, self.path, body,
+                self.headers.getheader('Content-Type') or 'application/json')
+        # gzip responses as a web server set up for it does
+        if 'gzip' in (self.headers.getheader('Accept-Encoding') or '') and len(response) >= 1024:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            response = compressor.compress(response) + compressor.flush()
+            headers = headers + [('Content-Encoding', 'gzip')]
+        self.server.testrail.add_wire_bytes(len(wire_body), len(response))
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        for header, value in headers:
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeTestRailServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    # concurrent clients open many connections at once. default backlog of 5 drops them.
+    request_queue_size = 128
+
+
+    def __init__(self, address, testrail):
+        BaseHTTPServer.HTTPServer.__init__(self, address, FakeTestRailHandler)
+        self.testrail = testrail
+
+
+def start_server(port=0, **kwargs):
+    '''
+    Start fake TestRail server in a background thread.  kwargs are passed to FakeTestRail.
+    Returns server. server.testrail is its FakeTestRail and server.server_port its port.
+    '''
+    server = FakeTestRailServer(('127.0.0.1', port), FakeTestRail(**kwargs))
+    thread = threading.Thread(target=server.serve_forever, name='FakeTestRailServer')
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for a TestRail server')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--user', default='listener@example.com', help='TestRail user the Listeners log in as')
+    parser.add_argument('--latency', type=float, default=0, help='secs added to each request')
+    parser.add_argument('--rate-limit', type=int, default=None, help='max requests per minute')
+    parser.add_argument('--page-size', type=int, default=250, help='max entries per page. 0 to not page')
+    args = parser.parse_args()
+    server = FakeTestRailServer(('127.0.0.1', args.port), FakeTestRail(
+            user=args.user, latency=args.latency, rate_limit=args.rate_limit, page_size=args.page_size))
+    print('Fake TestRail listening on http://127.0.0.1:{}/'.format(args.port))
+    server.serve_forever()
@@ -0,0 +1,262 @@
+#
+# Import the results of a finished robot run from its output.xml into TestRail.
+#
+# Runs the same mapping of RF suites and tests to TR Sections and Cases as TestRailRunListener,
+# so robot can be run without a Listener and the results added afterwards.  output.xml is
+# streamed so memory does not grow with the size of the run:
+#
+#   1. first pass gets the names of all RF suites and tests. The TR Run is added to the Plan
+#      once with the TR Case IDs of all of them (as TESTRAIL_SINGLE_ENTRY does).
+#   2. second pass sends the Results in batches with add_results_for_cases.
+#
+# Usage:
+#
+#   python TestRailImporter.py [--milestone M --plan P --run R] [--batch-size 250] output.xml
+#
+# Names of the Milestone, Plan, and Run are got from set_testrail_names() of TestRailServer.py
+# unless all three are given.  Most set_testrail_names() read RF variables, which are not
+# available after the run, so they usually need to be given.
+#
+import argparse
+import os
+import sys
+import time
+from xml.etree import cElementTree as ElementTree
+
+from TestRailListener import TestRailListener
+from TestRailResultUploader import ResultUploader
+from TestRailRunListener import TestRailRunListener
+from TestRailRunListener import set_testrail_names
+
+
+class ImportAbortedError(Exception):
+    pass
+
+
+class OutputSuite(object):
+
+    '''
+    Names of an RF suite of output.xml, its tests, and its sub suites.  Has the attributes of robot's
+    TestSuite used by TestRailRunListener.get_rf_suite_model_case_ids().
+    '''
+
+    __slots__ = ('name', 'tests', 'suites')
+
+
+    def __init__(self, name):
+        self.name = name
+        self.tests = []
+        self.suites = []
+
+
+class OutputTest(object):
+
+    __slots__ = ('name',)
+
+
+    def __init__(self, name):
+        self.name = name
+
+
+def iter_output_xml(path, results=True):
+    '''
+    Stream RF suites and tests of output.xml.  Yields tuples:
+
+        ('start_suite', id, name)
+        ('test', name, status, message, elapsed millisecs)
+        ('end_suite', id, name)
+
+    If results is False only names are got and status, message, and elapsed of tests are None.
+    Elements are dropped as soon as they end so memory used does not grow with the file.
+    '''
+    stack = []
+    for event, elem in ElementTree.iterparse(path, events=('start', 'end')):
+        if 'start' == event:
+            # suites are also listed in statistics. only those in the suite tree are RF suites.
+            if 'suite' == elem.tag and (not stack or stack[-1].tag in ('robot', 'suite')):
+                yield 'start_suite', elem.get('id'), elem.get('name')
+            stack.append(elem)
+            continue
+
+        stack.pop()
+        parent = stack[-1] if stack else None
+        if 'status' == elem.tag and parent is not None and 'test' == parent.tag:
+            if results:
+                yield 'test', parent.get('name'), elem.get('status'), elem.text or '', _elapsed_ms(elem)
+            else:
+                yield 'test', parent.get('name'), None, None, None
+        elif 'suite' == elem.tag and elem.get('id') is not None:
+            yield 'end_suite', elem.get('id'), elem.get('name')
+        elem.clear()
+        if parent is not None:
+            parent.remove(elem)
+
+
+def _elapsed_ms(status):
+    # RF 7 has elapsed secs. earlier RF has start and end times.
+    if status.get('elapsed') is not None:
+        return int(float(status.get('elapsed')) * 1000)
+    start = status.get('starttime')
+    end = status.get('endtime')
+    try:
+        if start[:8] == end[:8]:
+            # same day. strptime is too slow to call for every test.
+            return int(round((_day_secs(end) - _day_secs(start)) * 1000))
+        return int(round((_timestamp(end) - _timestamp(start)) * 1000))
+    except (TypeError, ValueError):
+        # N/A for tests that were not run
+        return 0
+
+
+def _day_secs(rf_time):
+    # e.g. 20240131 12:34:56.789
+    return int(rf_time[9:11]) * 3600 + int(rf_time[12:14]) * 60 + float(rf_time[15:])
+
+
+def _timestamp(rf_time):
+    return time.mktime(time.strptime(rf_time[:8], '%Y%m%d')) + _day_secs(rf_time)
+
+
+def read_output_suite(path):
+    # top-level OutputSuite of output.xml
+    suites = []
+    top = None
+    for event in iter_output_xml(path, results=False):
+        if 'start_suite' == event[0]:
+            suite = OutputSuite(event[2])
+            if suites:
+                suites[-1].suites.append(suite)
+            else:
+                top = suite
+            suites.append(suite)
+        elif 'test' == event[0]:
+            suites[-1].tests.append(OutputTest(event[1]))
+        else:
+            suites.pop()
+    return top
+
+
+class TestRailImporter(TestRailRunListener):
+
+    '''
+    TestRailRunListener driven by the suites and tests of an output.xml instead of by robot.
+
+    RF suites are buffered until they end, so the names of their tests are known when they are
+    started, and then their tests are ended.  Results with a status other than PASS or FAIL,
+    e.g. SKIP, are not imported.
+    '''
+
+
+    def __init__(self, output_xml, names=None, batch_size=250):
+        self.output_xml = output_xml
+        self.names = names
+        self.batch_size = batch_size
+        super(TestRailImporter, self).__init__()
+        self.logname = 'tr_import.log'
+        # all Cases are found from the first pass so there is one Plan entry update
+        self.prefetch = True
+        self.single_entry = True
+        self.skipped = 0
+
+    def create_result_uploader(self):
+        # batches are queued so output.xml is read while they are sent. few are queued so
+        # Results of a large output.xml are not all held when TestRail is slower than reading it.
+        return ResultUploader(self.testrail, self.logger, async_mode=True, queue_size=4,
+                timeout=self.srv_info.get('TESTRAIL_ASYNC_TIMEOUT', 300),
+                batch_size=self.batch_size, batch_interval=self.srv_info.get('TESTRAIL_BATCH_INTERVAL', 30))
+
+    def import_results(self):
+        # pending RF suites as [id, name, started, tests]. tests are (name, attrs) of ended RF tests.
+        pending = []
+        for event in iter_output_xml(self.output_xml):
+            if 'start_suite' == event[0]:
+                if pending and not pending[-1][2]:
+                    self._start_suite(pending[-1])
+                pending.append([event[1], event[2], False, []])
+            elif 'test' == event[0]:
+                _, name, status, message, elapsed = event
+                if status not in self.result_status_ids:
+                    self.skipped += 1
+                    continue
+                pending[-1][3].append((name, {'status': status, 'message': message, 'elapsedtime': elapsed}))
+            else:
+                suite = pending.pop()
+                if not suite[2]:
+                    self._start_suite(suite)
+                elif suite[3]:
+                    # suite with both sub suites and tests. its tests were not known when it was started
+                    self.add_rf_suite_tests_to_tr_run(self.suite_queue.current_id(), [t[0] for t in suite[3]])
+                for name, attrs in suite[3]:
+                    self.start_test(name, attrs)
+                    self.end_test(name, attrs)
+                self.end_suite(suite[1], {})
+        if self.skipped:
+            self.logger.log('\n{} RF tests not PASS or FAIL were not imported\n'.format(self.skipped))
+
+    def _start_suite(self, suite):
+        suite[2] = True
+        self.start_suite(suite[1], {'id': suite[0], 'tests': [t[0] for t in suite[3]]})
+
+    def end_suite(self, name, attrs):
+        # Results are not sent at the end of each suite as robot is not waiting on them.
+        # batches are only sent when full.
+        TestRailListener.end_suite(self, name, attrs)
+
+    def init_testrail_run(self):
+        super(TestRailImporter, self).init_testrail_run()
+        # names of all RF tests are not needed after Run is added
+        self.rf_suite_model = None
+
+    def get_output_dir(self):
+        return os.path.dirname(os.path.abspath(self.output_xml))
+
+    def get_rf_suite_model(self):
+        return read_output_suite(self.output_xml)
+
+    def get_shared_run_dir(self):
+        # robot processes are done so there is nothing to share with
+        return None
+
+    def init_site_specific_info(self):
+        if self.names is not None:
+            self.milestone, self.plan, self.run = self.names
+        else:
+            self.milestone, self.plan, self.run = set_testrail_names(self.logger)
+
+    def signal_quit(self):
+        # no robot run to abort. stop import instead.
+        self.logger.log('Aborting import\n')
+        raise ImportAbortedError()
+
+
+def main(cli_args):
+    parser = argparse.ArgumentParser(description='Import results of robot output.xml into TestRail')
+    parser.add_argument('--milestone', help='name of TestRail Milestone')
+    parser.add_argument('--plan', help='name of TestRail Plan')
+    parser.add_argument('--run', help='name of TestRail Run')
+    parser.add_argument('--batch-size', type=int, default=250, help='max Results sent in one request')
+    parser.add_argument('output_xml', help='output.xml of robot run')
+    args = parser.parse_args(cli_args)
+    names = None
+    if args.milestone or args.plan or args.run:
+        if not (args.milestone and args.plan and args.run):
+            parser.error('--milestone, --plan, and --run are given together')
+        names = (args.milestone, args.plan, args.run)
+
+    start = time.time()
+    importer = TestRailImporter(args.output_xml, names=names, batch_size=args.batch_size)
+    try:
+        importer.import_results()
+    except ImportAbortedError:
+        importer.close()
+        sys.stderr.write('Import aborted. See {}\n'.format(os.path.join(importer.get_output_dir(), importer.logname)))
+        return 1
+    importer.close()
+    failed = importer.uploader.failed
+    print('Imported {} in {:.1f}s. See {}'.format(args.output_xml, time.time() - start,
+            os.path.join(importer.get_output_dir(), importer.logname)))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
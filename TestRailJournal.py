@@ -0,0 +1,198 @@
+#
+# Write-ahead journal of TestRail Results and replay of the Results TestRail did not acknowledge.
+#
+# TestRailRunListener records each Result in the journal before it is sent, and records an ack
+# when TestRail accepts it.  Results of a run that failed to upload, or that were buffered or in
+# flight when robot died, can then be sent later:
+#
+#   python TestRailJournal.py [--batch-size 100] [--plan] output/tr_results_journal.jsonl
+#
+# --plan only prints the Results that would be sent.  Replay acks each batch it sends in the
+# same journal so it can itself be stopped and run again.  Results TestRail already has, e.g.
+# sent just before robot died but not acked, are found in the Run and not sent again.
+#
+import argparse
+import codecs
+import json
+import os
+import sys
+import threading
+import time
+
+from TestRailAPIClient import TestRailAPIError
+
+
+class ResultJournal(object):
+
+    '''
+    Append-only JSONL file of TR Results.
+
+    Each line is a record of a Result:
+
+        {"seq": 1, "time": 1700000000, "run_id": 2, "label": "Suite.Test", "result": {...}}
+
+    or an ack of Results TestRail accepted:
+
+        {"ack": [1, 2, 3]}
+
+    Lines are flushed to the OS as they are written so they outlast the robot process.  They
+    are only forced to disk at close() so a crash of the host can lose the last of them.
+    '''
+
+
+    def __init__(self, path):
+        self.path = path
+        # continue seq of journal of an earlier run in the same outputdir
+        self._seq = max([r['seq'] for r in read_journal(path)[0]] + [0])
+        self._lock = threading.Lock()
+        self._handle = open(path, 'a')
+
+    def record(self, run_id, result, label=''):
+        # returns seq of Result used to ack it
+        with self._lock:
+            self._seq += 1
+            self._write({'seq': self._seq, 'time': int(time.time()), 'run_id': run_id,
+                    'label': label, 'result': result})
+            return self._seq
+
+    def ack(self, seqs):
+        if seqs:
+            with self._lock:
+                self._write({'ack': list(seqs)})
+
+    def close(self):
+        with self._lock:
+            if self._handle is not None:
+                self._handle.flush()
+                os.fsync(self._handle.fileno())
+                self._handle.close()
+                self._handle = None
+
+    def _write(self, entry):
+        self._handle.write(json.dumps(entry) + '\n')
+        self._handle.flush()
+
+
+def read_journal(path):
+    '''
+    Returns list of Result records of journal and set of their seqs that are acked.
+    A partly written last line, e.g. from a crash, is ignored.
+    '''
+    records = []
+    acked = set()
+    if not os.path.exists(path):
+        return records, acked
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if 'ack' in entry:
+                acked.update(entry['ack'])
+            else:
+                records.append(entry)
+    return records, acked
+
+
+def replay(testrail, path, batch_size=100, log=None):
+    '''
+    Send the Results of journal at path that are not acked, in batches of up to batch_size
+    per Run.  Returns (sent, skipped, failed) counts.
+    '''
+    log = log or (lambda line: None)
+    records, acked = read_journal(path)
+    pending = [r for r in records if r['seq'] not in acked]
+    runs = []
+    by_run = {}
+    for r in pending:
+        if r['run_id'] not in by_run:
+            by_run[r['run_id']] = []
+            runs.append(r['run_id'])
+        by_run[r['run_id']].append(r)
+
+    journal = ResultJournal(path)
+    sent = skipped = failed = 0
+    try:
+        for run_id in runs:
+            # Results sent but not acked are already in TestRail. created_after is compared with TR
+            # server time so the Run's creation is used and not when Results were recorded on this host.
+            matches = _testrail_results(testrail, run_id, testrail.get_run(run_id)['created_on'] - 1)
+            to_send = []
+            for r in by_run[run_id]:
+                match = _result_match(r['result']['case_id'], r['result'])
+                if matches.get(match):
+                    # each Result in TestRail matches one pending Result
+                    matches[match] -= 1
+                    journal.ack([r['seq']])
+                    skipped += 1
+                    log(u'already in Testrail: {}'.format(r['label']))
+                else:
+                    to_send.append(r)
+            for i in range(0, len(to_send), batch_size):
+                batch = to_send[i:i + batch_size]
+                try:
+                    testrail.add_results_for_cases(run_id, [r['result'] for r in batch])
+                except TestRailAPIError as e:
+                    failed += len(batch)
+                    log(u'ERROR: add results for cases error: [{}: {}] ({})'.format(
+                            e.code, e.error, u', '.join(r['label'] for r in batch)))
+                    continue
+                journal.ack([r['seq'] for r in batch])
+                sent += len(batch)
+                log('sent {} Results to Run {}'.format(len(batch), run_id))
+    finally:
+        journal.close()
+    return sent, skipped, failed
+
+
+def _result_match(case_id, result):
+    return case_id, result['status_id'], result.get('comment')
+
+
+def _testrail_results(testrail, run_id, created_after):
+    # counts of Results of Run created after created_after by case ID, status, and comment
+    case_ids = dict((t['id'], t['case_id']) for t in testrail.iter_tests(run_id))
+    matches = {}
+    for tr_result in testrail.iter_results_for_run(run_id, created_after=created_after):
+        match = _result_match(case_ids.get(tr_result['test_id']), tr_result)
+        matches[match] = matches.get(match, 0) + 1
+    return matches
+
+
+def main(cli_args):
+    parser = argparse.ArgumentParser(description='Send Results of a TestRail journal that TestRail did not acknowledge')
+    parser.add_argument('--batch-size', type=int, default=100, help='max Results sent in one request')
+    parser.add_argument('--plan', action='store_true', help='only print Results that would be sent')
+    parser.add_argument('journal', help='tr_results_journal.jsonl in RF outputdir')
+    args = parser.parse_args(cli_args)
+
+    # labels are unicode. they are encoded for the console, or as UTF-8 if output is piped.
+    out = codecs.getwriter(sys.stdout.encoding or 'utf-8')(sys.stdout, 'replace')
+    records, acked = read_journal(args.journal)
+    pending = [r for r in records if r['seq'] not in acked]
+    if args.plan:
+        for r in pending:
+            out.write(u'Run {}: {}\n'.format(r['run_id'], r['label']))
+        print('{} of {} Results not acknowledged'.format(len(pending), len(records)))
+        return 0
+
+    # import Testrail server info
+    from TestRailListener import create_testrail_client
+    try:
+        from  TestRailServer import get_testrail_srv_info
+    except ImportError as e:
+        raise ValueError('Function not imported from TestRailServer.py.  Error: {}'.format(e))
+    testrail = create_testrail_client(get_testrail_srv_info())
+    try:
+        sent, skipped, failed = replay(testrail, args.journal, batch_size=args.batch_size,
+                log=lambda line: out.write(line + u'\n'))
+    except TestRailAPIError as e:
+        sys.stderr.write('TestRail error: {}: {}\n'.format(e.code, e.error))
+        return 1
+    print('Testrail Results: {} sent, {} already in Testrail, {} failed'.format(sent, skipped, failed))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,9 +1,21 @@
+import json
 import os
+import re
 import signal
+import sys
+import tempfile
+import threading
+import time
 from robot.api import logger
+from robot.api import TestSuiteBuilder
+from robot.conf import RobotSettings
 from robot.libraries.BuiltIn import BuiltIn
+from robot.run import RobotFramework
 from TestRailAPIClient import TestRailAPIClient
 from TestRailAPIClient import TestRailAPIError
+from TestRailDaemon import TestRailDaemonClient
+from TestRailStats import CallStats
+from TestRailStats import format_report
 
 # import Testrail server info
 try:
@@ -32,11 +44,16 @@ class TestRailListener(object):
         Pop suite from queue
 
     close():
-        Log log if enabled.
+        Log summary of time spent in Listener events and TR requests.
+        Close log if enabled.
     '''
 
     ROBOT_LISTENER_API_VERSION = 2
 
+    # RF Listener events that are timed if Listener has them
+    TIMED_EVENTS = ('start_suite', 'end_suite', 'start_test', 'end_test', 'start_keyword',
+            'end_keyword', 'log_message', 'message', 'close')
+
 
     def __init__(self):
         # logging
@@ -56,23 +73,37 @@ class TestRailListener(object):
             self.testrail_server   = srv_info['TESTRAIL_SERVER']
             self.testrail_user     = srv_info['TESTRAIL_USER']
             self.testrail_password = srv_info['TESTRAIL_PW']
-            protocol               = srv_info['TESTRAIL_PROTOCOL']
         except KeyError as e:
             raise ValueError('TestRail server value for {} not found. Ensure TestRailServer.py exists and has needed info.'.format(e))
             self.signal_quit()
+        # keep for optional settings. see RENAME_TestRailServer.py
+        self.srv_info = srv_info
 
+        # IDs of Automated case type and TR user are got in the background from first suite
+        # so robot does not wait on TR to start
         if self.testrail_server is not None:
-            self.testrail = TestRailAPIClient(
-                    self.testrail_server,
-                    protocol=protocol,
-                    user=self.testrail_user,
-                    password=self.testrail_password)
-            self.auto_type = self.testrail.get_automated_test_case_type()
-            self.user_id = self.testrail.get_user_id(self.testrail_user)
+            self.testrail = create_testrail_client(srv_info)
+            self.lookups = TestRailLookups(self.testrail, self.testrail_server, self.testrail_user,
+                    cache_dir=srv_info.get('TESTRAIL_CACHE_DIR'), max_age=srv_info.get('TESTRAIL_CACHE_MAX_AGE', 86400))
         else:
             self.testrail = None
-            self.auto_type = None
-            self.user_id = None
+            self.lookups = None
+
+        # time spent in each Listener event is time added to the robot run.
+        # robot calls the event methods of the instance so they are replaced by timed ones.
+        self.event_stats = CallStats()
+        self._close_start = None
+        for event in self.TIMED_EVENTS:
+            if hasattr(self, event):
+                setattr(self, event, self._timed_event(event, getattr(self, event)))
+
+    @property
+    def auto_type(self):
+        return self.lookups.get('auto_type') if self.lookups is not None else None
+
+    @property
+    def user_id(self):
+        return self.lookups.get('user_id') if self.lookups is not None else None
 
     def start_suite(self, name, attrs):
         if 's1' == attrs['id']:
@@ -80,6 +111,8 @@ class TestRailListener(object):
             # must be done here on first suite event and not in __init__ as BuiltIn cannot be
             # accessed until in a test context
             self.logger.open(self.logname)
+            if self.lookups is not None:
+                self.lookups.start()
             tr_section_id, msg = self.init_testrail_testsuite(name)
         else:
             if 's1-s1' == attrs['id']:
@@ -107,8 +140,54 @@ class TestRailListener(object):
         self.logger.log('{}\n'.format(self.suite_queue.current_path()))
 
     def close(self):
+        self.log_stats()
         self.logger.close()
 
+    def log_stats(self):
+        '''
+        Log summary of time spent in Listener events and TR requests: totals, percentiles, top
+        events and endpoints, and histograms of latencies.  Unless TESTRAIL_STATS is False it is
+        also written as JSON, e.g. tr_listener_stats.json for tr_listener.log, in RF output dir.
+        '''
+        if self._close_start is not None:
+            # close is still running
+            self.event_stats.record('close', time.time() - self._close_start)
+        events = self.event_stats.summary()
+        client_stats = getattr(self.testrail, 'stats', None)
+        requests = client_stats.summary() if client_stats is not None else {}
+        added = sum(s['total'] for s in events.values())
+
+        lines = ['', 'Listener overhead: {:.3f}s added to robot run'.format(added)]
+        lines += format_report('Listener events', events)
+        # Results sent by background threads are included
+        lines += format_report('TestRail requests', requests)
+        self.logger.log('\n'.join(lines) + '\n')
+
+        if not self.srv_info.get('TESTRAIL_STATS', True) or self.logger.outputdir is None:
+            return
+        path = os.path.join(self.logger.outputdir, '{}_stats.json'.format(os.path.splitext(self.logname)[0]))
+        try:
+            with open(path, 'w') as f:
+                json.dump({'time': time.time(), 'added_secs': added, 'events': events, 'requests': requests},
+                        f, indent=2, sort_keys=True)
+        except (IOError, OSError) as e:
+            self.logger.log('\tLISTENER ERROR: writing stats to {} failed: {}\n'.format(path, e), console=True)
+
+    def _timed_event(self, event, method):
+        def timed(*args):
+            start = time.time()
+            if 'close' == event:
+                # recorded by log_stats() so it is in the summary
+                self._close_start = start
+                return method(*args)
+            try:
+                return method(*args)
+            finally:
+                self.event_stats.record(event, time.time() - start)
+        # robot names the listener method in its errors. some events are handled by methods of other names.
+        timed.__name__ = event
+        return timed
+
     def init_site_specific_info(self):
         '''
         Example site specific info.
@@ -133,6 +212,25 @@ class TestRailListener(object):
         msg = '{}.{}\n'.format(self.suite_queue.current_path(), rf_suite_name)
         return 1 + self.suite_queue.current_id(), msg
 
+    def get_rf_suite_model(self):
+        '''
+        Build the RF suite tree of this run from robot's command line the same way robot does,
+        including --suite, --test, --include, and --exclude filters.  Pre-run modifiers are not applied.
+
+        Returns top-level RF running TestSuite or None if the command line cannot be parsed, e.g.
+        when robot is started from python with robot.run().
+        '''
+        try:
+            rf_suite = build_rf_suite_model(sys.argv[1:])
+        except Exception as e:
+            self.logger.log(' - Failed to build RF suite tree from command line: {}\n'.format(e))
+            return None
+        return rf_suite
+
+    def get_output_dir(self):
+        # RF output dir of this run
+        return BuiltIn().get_variable_value("$outputdir")
+
     def signal_quit(self):
         self.logger.log('Sending SIGINT from Listener to abort test run\n')
         os.kill(os.getpid(), signal.SIGINT)
@@ -141,22 +239,194 @@ class TestRailListener(object):
         os.kill(os.getpid(), signal.SIGINT)
 
 
+def create_testrail_client(srv_info):
+    '''
+    TR api client for server info returned by get_testrail_srv_info() of TestRailServer.py.
+    If TESTRAIL_DAEMON_SOCKET is set requests are sent to TestRailDaemon.py instead.
+    '''
+    if srv_info.get('TESTRAIL_DAEMON_SOCKET'):
+        return TestRailDaemonClient(srv_info['TESTRAIL_DAEMON_SOCKET'])
+    return TestRailAPIClient(
+            srv_info['TESTRAIL_SERVER'],
+            protocol=srv_info['TESTRAIL_PROTOCOL'],
+            user=srv_info['TESTRAIL_USER'],
+            password=srv_info['TESTRAIL_PW'],
+            pool_size=srv_info.get('TESTRAIL_POOL_SIZE', 4),
+            timeout=srv_info.get('TESTRAIL_TIMEOUT', 60),
+            max_retries=srv_info.get('TESTRAIL_MAX_RETRIES', 5),
+            requests_per_minute=srv_info.get('TESTRAIL_REQUESTS_PER_MINUTE'),
+            compress_requests=srv_info.get('TESTRAIL_COMPRESS_REQUESTS', False))
+
+
+def build_rf_suite_model(cli_args):
+    '''
+    Build RF suite tree from robot command line arguments the same way robot does, including
+    --suite, --test, --include, --exclude, --extension, --rpa, and --runemptysuite.  Pre-run
+    modifiers are not applied.
+
+    Returns top-level RF running TestSuite.  Raises robot's DataError if arguments or RF data are not valid.
+    '''
+    options, datasources = RobotFramework().parse_arguments(cli_args)
+    # robot ignores options without value
+    options = dict((k, v) for k, v in options.items() if v not in (None, []))
+    settings = RobotSettings(options)
+    rf_suite = TestSuiteBuilder(settings['SuiteNames'], included_extensions=settings.extension,
+            rpa=settings.rpa, allow_empty_suite=settings.run_empty_suite).build(*datasources)
+    rf_suite.configure(**settings.suite_config)
+    return rf_suite
+
+
+def write_json_cache(path, data):
+    '''
+    Write data as JSON to cache file path.  The file is replaced so parallel runs do not read part
+    of it.  Errors are ignored as caches are only an optimization.
+    '''
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        pass
+
+
+class TestRailLookups(object):
+
+    '''
+    TR IDs that are the same for every run: the ID of the Automated case type and the ID of the TR user.
+
+    start() gets those not in the cache file in background threads, concurrently.  get() waits for
+    one and raises the error of its lookup if it failed.  IDs are cached in a JSON file in cache_dir,
+    or the temp dir, and are got again when older than max_age secs.
+    '''
+
+
+    def __init__(self, testrail, server, user, cache_dir=None, max_age=86400):
+        self.max_age = max_age
+        name = re.sub(r'[^\w.-]', '_', '{}_{}'.format(server, user))
+        self.path = os.path.join(cache_dir or tempfile.gettempdir(), 'tr_lookups_{}.json'.format(name))
+        self._getters = {
+            'auto_type': testrail.get_automated_test_case_type,
+            'user_id': lambda: testrail.get_user_id(user),
+        }
+        self._values = {}
+        self._errors = {}
+        self._threads = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._threads is not None:
+                return
+            self._threads = {}
+            self._values.update(self._read_cache())
+            for name in self._getters:
+                if name not in self._values:
+                    thread = threading.Thread(target=self._lookup, args=(name,), name='TestRailLookup-{}'.format(name))
+                    # do not let a hung TR connection keep RF from exiting
+                    thread.daemon = True
+                    thread.start()
+                    self._threads[name] = thread
+
+    def get(self, name):
+        # started here if used before first suite
+        self.start()
+        if name in self._threads:
+            self._threads[name].join()
+        if name in self._errors:
+            raise self._errors[name]
+        return self._values[name]
+
+    def _lookup(self, name):
+        try:
+            value = self._getters[name]()
+        except Exception as e:
+            self._errors[name] = e
+            return
+        with self._lock:
+            self._values[name] = value
+            self._write_cache()
+
+    def _read_cache(self):
+        try:
+            with open(self.path) as f:
+                cached = json.load(f)
+        except (IOError, ValueError):
+            return {}
+        if time.time() - cached.get('time', 0) > self.max_age:
+            return {}
+        return dict((k, v) for k, v in cached.items() if k in self._getters)
+
+    def _write_cache(self):
+        write_json_cache(self.path, dict(self._values, time=time.time()))
+
+
+class TestRailNameCache(object):
+
+    '''
+    Persistent cache of the IDs of TR entities by name, e.g. Milestones and Plans, of a TR server
+    and Project.  Cached IDs may be of entities since deleted, renamed, or completed so users of
+    the cache check them with one get call before using them.
+
+    IDs are in a JSON file in cache_dir, or the temp dir.  The file is read for each lookup and
+    replaced for each change so parallel runs share it.
+    '''
+
+
+    def __init__(self, server, project_id, cache_dir=None):
+        name = re.sub(r'[^\w.-]', '_', '{}_{}'.format(server, project_id))
+        self.path = os.path.join(cache_dir or tempfile.gettempdir(), 'tr_names_{}.json'.format(name))
+        self._lock = threading.Lock()
+
+    def get(self, kind, name):
+        return self._read().get(kind, {}).get(name)
+
+    def set(self, kind, name, tr_id):
+        with self._lock:
+            cached = self._read()
+            if tr_id is None:
+                cached.get(kind, {}).pop(name, None)
+            else:
+                cached.setdefault(kind, {})[name] = tr_id
+            self._write(cached)
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _write(self, cached):
+        write_json_cache(self.path, cached)
+
+
 class ListenerLogger(object):
 
 
     def __init__(self, enabled=True):
         self.logging_enabled = enabled
+        self.outputdir = None
         self._log_handle = None
+        # log can be written from background threads
+        self._lock = threading.Lock()
 
-    def open(self, filename):
+    def open(self, filename, outputdir=None):
+        if outputdir is None:
+            outputdir = BuiltIn().get_variable_value("$outputdir")
+        self.outputdir = outputdir
         if self.logging_enabled:
             # create log file in RF output dir
-            logname = '{}/{}'.format(BuiltIn().get_variable_value("$outputdir"), filename)
+            logname = '{}/{}'.format(outputdir, filename)
             self._log_handle = open(logname, 'w')
 
     def log(self, msg, console=False):
-        if self._log_handle is not None:
-            self._log_handle.write(msg)
+        with self._lock:
+            if self._log_handle is not None:
+                # RF names and messages are unicode
+                self._log_handle.write(msg.encode('utf-8') if isinstance(msg, unicode) else msg)
         if console:
             self.log_console(msg)
 
@@ -164,8 +434,10 @@ class ListenerLogger(object):
             logger.console(msg)
 
     def close(self):
-        if self._log_handle is not None:
-            self._log_handle.close()
+        with self._lock:
+            if self._log_handle is not None:
+                self._log_handle.close()
+                self._log_handle = None
 
 
 class SuiteQueue(object):
@@ -192,3 +464,7 @@ class SuiteQueue(object):
         # string of all suite names currently in queue
         return '.'.join(self._suites)
 
+    def current_names(self):
+        # tuple of all suite names currently in queue
+        return tuple(self._suites)
+
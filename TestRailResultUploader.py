@@ -0,0 +1,236 @@
+import threading
+import time
+import Queue
+
+from TestRailAPIClient import TestRailAPIError
+
+
+class ResultUploader(object):
+
+    '''
+    Send TR Results of a TR Run to Testrail.
+
+    By default each Result is sent when it is added so the RF test waits on the TR api call.
+
+    In batch mode (batch_size > 1) Results are buffered and sent in one add_results_for_cases
+    call when batch_size Results are buffered, when the oldest buffered Result is older than
+    batch_interval secs, or when flush() is called.
+
+    In async mode Results, or batches of Results, are put on a bounded queue and a worker
+    thread sends them so RF end_test() does not wait on Testrail.  If the queue is full add()
+    waits for the worker to catch up.  close() waits for the queue to be emptied and returns
+    a summary of any Results that were not uploaded.
+
+    If a ResultJournal is set each Result is recorded in it when added and acked in it when
+    TestRail accepts it, so Results that were not uploaded can be sent later.
+
+    If an AttachmentUploader is set it is given the IDs of the TR Results that are sent so it can
+    upload their files.
+    '''
+
+    _STOP = object()
+
+
+    def __init__(self, testrail, logger, async_mode=False, queue_size=1000, timeout=300,
+            batch_size=1, batch_interval=30, journal=None, attachments=None):
+        self.testrail = testrail
+        self.logger = logger
+        self.journal = journal
+        self.attachments = attachments
+        self.async_mode = async_mode
+        self.timeout = timeout
+        self.batch_size = max(1, batch_size)
+        self.batch_interval = batch_interval
+
+        # counts and labels of Results for close() summary
+        self.uploaded = 0
+        self.failed = []
+        self._inflight = None
+
+        # buffered Results waiting to be sent as a batch. list of (run_id, result, label, seq).
+        # seq is journal seq of Result or None
+        self._buffer = []
+        self._buffer_time = None
+        self._lock = threading.Lock()
+
+        self._queue = None
+        self._worker = None
+        if self.async_mode:
+            self._queue = Queue.Queue(maxsize=queue_size)
+            self._worker = threading.Thread(target=self._run, name='TestRailResultUploader')
+            # do not let a hung TR connection keep RF from exiting
+            self._worker.daemon = True
+            self._worker.start()
+
+    def add(self, run_id, result, label=''):
+        '''
+        Add TR Result dict for a Case to Run run_id.  label is used to identify Result in log.
+
+        Returns TestRailAPIError if Result was sent on its own and failed, otherwise None.
+        Failures of batches and of Results sent by the worker are logged by the uploader.
+        '''
+        seq = self.journal.record(run_id, result, label) if self.journal is not None else None
+        if self.batch_size > 1:
+            with self._lock:
+                if not self._buffer:
+                    self._buffer_time = time.time()
+                self._buffer.append((run_id, result, label, seq))
+                full = len(self._buffer) >= self.batch_size
+            if full or self._buffer_stale():
+                self.flush()
+            return None
+        if self.async_mode:
+            self._queue.put((run_id, [result], [label], [seq]))
+            return None
+        return self._send(run_id, [result], [label], [seq])
+
+    def flush(self):
+        '''
+        Send buffered Results.  In async mode they are queued for the worker.
+        '''
+        for batch in self._take_buffer():
+            if self.async_mode:
+                self._queue.put(batch)
+            else:
+                self._process(batch)
+
+    def close(self):
+        '''
+        Send buffered Results and wait up to timeout secs for queued Results to be sent.  Returns
+        summary message of upload.
+        '''
+        unsent = []
+        if not self.async_mode:
+            self.flush()
+        else:
+            # one deadline for all waits. a hung worker cannot empty a full queue.
+            deadline = time.time() + self.timeout
+            for batch in self._take_buffer():
+                if not self._put_before(batch, deadline):
+                    unsent.extend(batch[2])
+            if self._put_before(self._STOP, deadline):
+                self._worker.join(max(0, deadline - time.time()))
+            if self._worker.is_alive():
+                # worker did not finish in time. whatever is still on the queue is not sent.
+                if self._inflight is not None:
+                    unsent.extend(self._inflight[2])
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except Queue.Empty:
+                        break
+                    if item is not self._STOP:
+                        unsent.extend(item[2])
+
+        msg = u'\nTestrail Results: {} uploaded, {} failed, {} not sent\n'.format(
+                self.uploaded, len(self.failed), len(unsent))
+        for label in self.failed:
+            msg += u' - failed: {}\n'.format(label)
+        for label in unsent:
+            msg += u' - not sent: {}\n'.format(label)
+        if self.journal is not None:
+            self.journal.close()
+            if self.failed or unsent:
+                msg += u'Send Results not uploaded with: python TestRailJournal.py {}\n'.format(self.journal.path)
+        return msg
+
+    def _put_before(self, item, deadline):
+        # put item on queue unless it is still full at deadline. returns True if put.
+        try:
+            self._queue.put(item, timeout=max(0, deadline - time.time()))
+        except Queue.Full:
+            return False
+        return True
+
+    def _buffer_stale(self):
+        return self._buffer_time is not None and time.time() - self._buffer_time >= self.batch_interval
+
+    def _take_buffer(self):
+        # empty buffer and return it as batches of (run_id, results, labels, seqs). one per Run.
+        with self._lock:
+            buffered = self._buffer
+            self._buffer = []
+            self._buffer_time = None
+        # Results of Runs can be mixed when the uploader is shared, e.g. by TestRailDaemon.py
+        batches = []
+        run_batches = {}
+        for run_id, result, label, seq in buffered:
+            if run_id not in run_batches:
+                run_batches[run_id] = (run_id, [], [], [])
+                batches.append(run_batches[run_id])
+            run_batches[run_id][1].append(result)
+            run_batches[run_id][2].append(label)
+            run_batches[run_id][3].append(seq)
+        return batches
+
+    def _run(self):
+        # when batching wake up at least every batch_interval secs so buffered Results
+        # are sent even if RF is busy in a long running test.
+        wait = self.batch_interval if self.batch_size > 1 else None
+        while True:
+            try:
+                item = self._queue.get(timeout=wait)
+            except Queue.Empty:
+                if self._buffer_stale():
+                    for batch in self._take_buffer():
+                        self._process(batch)
+                continue
+            if item is self._STOP:
+                return
+            self._process(item)
+
+    def _process(self, batch):
+        # send batch and log failure. used by worker and for sync batches.
+        self._inflight = batch
+        run_id, results, labels, seqs = batch
+        try:
+            error = self._send(run_id, results, labels, seqs)
+        except Exception as e:
+            # network errors etc. worker must not die or queue will never empty
+            self.failed.extend(labels)
+            error = TestRailAPIError(99, repr(e))
+        self._inflight = None
+        if error is not None:
+            self._log_failure(error, labels)
+
+    def _log_failure(self, error, labels):
+        # labels are unicode RF names. called by worker, which must not die if logging fails.
+        # failed Results are listed in close() summary either way.
+        try:
+            self.logger.log(u'\tLISTENER ERROR: add results for cases error: [{}: {}] ({})\n'.format(
+                    error.code, error.error, u', '.join(labels)), console=True)
+        except Exception:
+            pass
+
+    def _send(self, run_id, results, labels, seqs):
+        try:
+            if self.batch_size > 1:
+                responses = self.testrail.add_results_for_cases(run_id, results)
+            else:
+                result = results[0]
+                responses = [self.testrail.add_result_for_case(run_id, result['case_id'], result['status_id'],
+                        elapsed=result.get('elapsed'), comment=result.get('comment'),
+                        custom_fields=dict((k, v) for k, v in result.items() if k.startswith('custom_')))]
+        except TestRailAPIError as e:
+            if 400 == e.code and len(results) > 1:
+                self._send_halves(run_id, results, labels, seqs)
+                return None
+            self.failed.extend(labels)
+            if self.attachments is not None:
+                self.attachments.results_sent(results, None)
+            return e
+        if self.attachments is not None:
+            self.attachments.results_sent(results, responses)
+        self.uploaded += len(results)
+        if self.journal is not None:
+            self.journal.ack([seq for seq in seqs if seq is not None])
+        return None
+
+    def _send_halves(self, run_id, results, labels, seqs):
+        # TR rejects a whole batch with 400 if any Result in it is bad, e.g. for a Case not in Run.
+        # each half is sent, and split again if rejected, so the other Results are still uploaded.
+        half = len(results) // 2
+        for part in (slice(None, half), slice(half, None)):
+            error = self._send(run_id, results[part], labels[part], seqs[part])
+            if error is not None:
+                self._log_failure(error, labels[part])
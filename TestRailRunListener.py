@@ -1,5 +1,20 @@
+import collections
+import os
+import re
+import sqlite3
+from robot.libraries.BuiltIn import BuiltIn
 from TestRailAPIClient import TestRailAPIError
+from TestRailAttachments import AttachmentUploader
+from TestRailCoordinator import RunCoordinator
+from TestRailCoordinator import invocation_id
+from TestRailDaemon import ResultForwarder
+from TestRailJournal import ResultJournal
 from TestRailListener import TestRailListener
+from TestRailListener import TestRailNameCache
+from TestRailResultUploader import ResultUploader
+from TestRailSteps import KeywordSteps
+from TestRailSuiteIndex import SuiteCache
+from TestRailSuiteIndex import SuiteIndex
 
 # import site specific function
 # used to define the names used in Testrail for Milestone, Plan, and Run from an RF test run
@@ -34,24 +49,48 @@ class TestRailRunListener(TestRailListener):
         As TR Tests are added to Run update map of RF-test-title to TR-Case-ID.
 
         On first RF suite add TR Testsuite ID to progress queue instead of a TR section ID, and run other
-        initializations tasks.  Top level Suite Setup has NOT been called yet as start_suite() is
+        initializations tasks.  If TESTRAIL_PREFETCH is set all TR Sections and Cases of the Testsuite are
+        fetched and later suites are mapped to TR from them without any more api calls.  Top level Suite Setup has NOT been called yet as start_suite() is
         called before all suite setups.
 
         On second suite top level Suite Setup has been run so initialize TR entries Milestone and Plan that
         results will be added to. Names used will be based on TR variables created by RF top level suite.
         This logic will need to be customized for each TR/RF install.
 
+        If TESTRAIL_SINGLE_ENTRY is set the TR Run is added to the Plan on the second suite with the TR Case
+        IDs of all RF tests that will be run, instead of being updated as each RF suite is run.  The RF tests
+        are found by building the RF suite tree from robot's command line.
+
+        If TESTRAIL_SHARED_RUN is set the Listeners of the robot processes started by pabot share one
+        Milestone, Plan, and Run.  The first process to get to them finds or adds them and the others
+        use them.  Case IDs added to the Run by processes at the same time are sent in one update.
+
     start_test():
        (From parent class) Log current test being run
 
+    start_keyword(), end_keyword():
+        Only if TESTRAIL_STEP_RESULTS is set.  Keep the last RF keywords of the test.
+
+    log_message():
+        Only if TESTRAIL_ATTACHMENTS is set.  Keep the screenshots logged by the test, e.g. by SeleniumLibrary.
+
     end_test():
-        Add RF result to TR Test Case.
+        Add RF result to TR Test Case.  If TESTRAIL_STEP_RESULTS is set a failed Result has the kept
+        keywords as TR step results.  If TESTRAIL_BATCH_SIZE is set Results are buffered and sent
+        in batches.  If TESTRAIL_ASYNC_RESULTS is set Results are queued and sent from a background thread.
+        If TESTRAIL_JOURNAL is set Results are recorded in a journal in the RF output dir before they are
+        sent so those TestRail did not accept can be sent later with TestRailJournal.py.
+        If TESTRAIL_ATTACHMENTS is set the screenshots of a failed test are uploaded to its Result in the
+        background once the Result is sent.
 
     suite_end():
-        Pop suite from queue
+        Send buffered Results. Pop suite from queue
+
+    log_file():
+        Only if TESTRAIL_ATTACHMENTS is set.  Upload RF log.html to the TR Run in the background.
 
     close():
-        Log log if enabled.
+        Wait for queued Results and attachments to be sent and log summary. Close log if enabled.
     '''
 
     ROBOT_LISTENER_API_VERSION = 2
@@ -67,6 +106,18 @@ class TestRailRunListener(TestRailListener):
 
         # Testrail info
         self.testsuite_id = None
+        # index of all TR Sections and Cases in Testsuite. set at first suite if prefetch is enabled.
+        self.prefetch = self.srv_info.get('TESTRAIL_PREFETCH', False)
+        self.suite_index = None
+        # SuiteCache suite index was loaded from, if any
+        self.suite_cache = None
+        # TR Case IDs found in suite cache that are no longer in TR
+        self.stale_case_ids = set()
+        # add TR Run with all RF tests at once. needs all TR Sections and Cases up front.
+        self.single_entry = self.srv_info.get('TESTRAIL_SINGLE_ENTRY', False)
+        if self.single_entry:
+            self.prefetch = True
+        self.rf_suite_model = None
         self.milestone = None
         self.milestone_id = None
         self.plan = None
@@ -74,24 +125,83 @@ class TestRailRunListener(TestRailListener):
         self.run = None
         self.run_id = None
         self.entry_id = None
+        # TR Case IDs already added to Run. update_plan_entry replaces the Case IDs of the
+        # entry so all of them are sent each time it is called.
+        self.run_case_ids = set()
+        # dir of state of Run shared with parallel robot processes. set at first suite if enabled.
+        self.shared_run_dir = None
+        self.coordinator = None
         self.result_status_ids = {'PASS': 1, 'FAIL': 5}
-
+        # IDs of Milestones and Plans by name from earlier runs
+        self.name_cache = TestRailNameCache(self.testrail_server, self.project_id,
+                cache_dir=self.srv_info.get('TESTRAIL_CACHE_DIR'))
+
+        # TR Results are sent by uploader. optionally from a background thread.
+        self.uploader = self.create_result_uploader()
+
+        # last RF keywords of each test are sent as TR step results of failed tests. robot calls
+        # the keyword events of every keyword so the Listener only has them when enabled.
+        self.steps = None
+        if self.srv_info.get('TESTRAIL_STEP_RESULTS', False):
+            self.steps = KeywordSteps(max_steps=self.srv_info.get('TESTRAIL_STEP_RESULTS_MAX', 50),
+                    max_field=self.srv_info.get('TESTRAIL_STEP_RESULTS_FIELD_SIZE', 250))
+            self.start_keyword = self._timed_event('start_keyword', self.steps.start_keyword)
+            self.end_keyword = self._timed_event('end_keyword', self.steps.end_keyword)
+
+        # screenshots of failed tests and RF log.html are uploaded in the background. Result IDs
+        # are needed so not with a daemon, which sends Results itself.
+        self.attachments = None
+        if self.srv_info.get('TESTRAIL_ATTACHMENTS', False) and isinstance(self.uploader, ResultUploader):
+            self.attachments = AttachmentUploader(self.testrail, self.logger,
+                    max_bytes=self.srv_info.get('TESTRAIL_ATTACHMENTS_MAX_BYTES', 50 * 1024 * 1024),
+                    timeout=self.srv_info.get('TESTRAIL_ASYNC_TIMEOUT', 300))
+            self.uploader.attachments = self.attachments
+            # last screenshots logged by current test
+            self.screenshots = collections.deque(maxlen=5)
+            self.log_message = self._timed_event('log_message', self.collect_screenshots)
+            self.log_file = self._timed_event('log_file', self.attach_log_file)
+
+    def create_result_uploader(self):
+        # with a daemon Results are forwarded to it and it sends them in batches.
+        # an async uploader starts its thread so this is only called once.
+        if self.srv_info.get('TESTRAIL_DAEMON_SOCKET'):
+            return ResultForwarder(self.testrail)
+        return ResultUploader(self.testrail, self.logger,
+                async_mode=self.srv_info.get('TESTRAIL_ASYNC_RESULTS', False),
+                queue_size=self.srv_info.get('TESTRAIL_ASYNC_QUEUE_SIZE', 1000),
+                timeout=self.srv_info.get('TESTRAIL_ASYNC_TIMEOUT', 300),
+                batch_size=self.srv_info.get('TESTRAIL_BATCH_SIZE', 1),
+                batch_interval=self.srv_info.get('TESTRAIL_BATCH_INTERVAL', 30))
 
     def start_suite(self, name, attrs):
         if 's1' == attrs['id']:
             # first suite encountered. open Listener log in RF output dir and connect to Testrail.
             # must be done here on first suite event and not in __init__ as BuiltIn cannot be
             # accessed until in a test context
-            self.logger.open(self.logname)
+            self.logger.open(self.logname, self.get_output_dir())
+            self.lookups.start()
             tr_section_id, msg = self.init_testrail_testsuite(name)
+            self.shared_run_dir = self.get_shared_run_dir()
+            if self.srv_info.get('TESTRAIL_JOURNAL', False) and isinstance(self.uploader, ResultUploader):
+                # journal is in RF output dir so it is set here and not in __init__
+                self.uploader.journal = ResultJournal(os.path.join(self.get_output_dir(), 'tr_results_journal.jsonl'))
+            if self.prefetch:
+                self.init_testrail_suite_index()
+            if self.single_entry:
+                self.rf_suite_model = self.get_rf_suite_model()
             tests = attrs['tests']
         else:
             if 's1-s1' == attrs['id']:
                 # second suite encountered. top level RF suite setup has been executed. so init Listener data
                 # that is based on what top level RF suite setup has set from actual test run.
                 self.init_site_specific_info()
-                self.init_testrail_milestone()
-                self.init_testrail_plan()
+                if self.shared_run_dir is not None:
+                    self.init_shared_testrail_plan()
+                else:
+                    self.init_testrail_milestone()
+                    self.init_testrail_plan()
+                if self.rf_suite_model is not None:
+                    self.init_testrail_run()
                 self.logger.log('\nSuites:\n{}\n'.format(self.suite_queue.current_path()))
             # get tr section ID based on RF suite name
             tr_section_id, tests, msg = self.init_testrail_section(name, attrs['tests'])
@@ -100,6 +210,14 @@ class TestRailRunListener(TestRailListener):
         # process this suite's data and tests if they exist
         self.add_rf_suite_tests_to_tr_run(tr_section_id, tests)
 
+    def start_test(self, name, attrs):
+        if self.steps is not None:
+            # drop keywords of suite setup and previous test
+            self.steps.clear()
+        if self.attachments is not None:
+            self.screenshots.clear()
+        super(TestRailRunListener, self).start_test(name, attrs)
+
     def end_test(self, name, attrs):
         # set TR Result data from RF attrs
         result_id = self.result_status_ids[attrs['status']]
@@ -113,19 +231,49 @@ class TestRailRunListener(TestRailListener):
             case_id = self.title2caseid[section_id][name]
         except KeyError:
             # log but do not quit.
-            self.logger.log('{} [{}] ({}) - failed to get case ID\n'.format(attrs['status'], duration, msg))
+            self.logger.log(u'{} [{}] ({}) - failed to get case ID\n'.format(attrs['status'], duration, msg))
             return
 
         # add TR Result
-        try:
-            resp = self.testrail.add_result_for_case(self.run_id, case_id, result_id,
-                    elapsed=duration, comment=msg)
-        except TestRailAPIError as e:
+        result = {'case_id': case_id, 'status_id': result_id, 'elapsed': duration, 'comment': msg}
+        if self.steps is not None and 'FAIL' == attrs['status']:
+            try:
+                result['custom_step_results'] = self.steps.step_results(msg)
+            except Exception as e:
+                # log but send Result without steps
+                self.logger.log('\tLISTENER ERROR: step results error: {!r}\n'.format(e), console=True)
+        label = u'{}.{}'.format(self.suite_queue.current_path(), name)
+        if self.attachments is not None and 'FAIL' == attrs['status']:
+            self.attachments.expect(result, self.screenshots, label)
+        e = self.uploader.add(self.run_id, result, label)
+        if e is not None:
             # log but do not quit.
-            self.logger.log('failed to update - {} [{}] ({})\n'.format(attrs['status'], duration, msg))
+            self.logger.log(u'failed to update - {} [{}] ({})\n'.format(attrs['status'], duration, msg))
             self.logger.log('\tLISTENER ERROR: add result for case error: [{}: {}]\n'.format(e.code, e.error), console=True)
             return
-        self.logger.log('{} [{}] ({})\n'.format(attrs['status'], duration, msg))
+        self.logger.log(u'{} [{}] ({})\n'.format(attrs['status'], duration, msg))
+
+    def end_suite(self, name, attrs):
+        self.uploader.flush()
+        super(TestRailRunListener, self).end_suite(name, attrs)
+
+    def close(self):
+        self.logger.log(self.uploader.close())
+        if self.attachments is not None:
+            self.logger.log(self.attachments.close())
+        super(TestRailRunListener, self).close()
+
+    def collect_screenshots(self, message):
+        # screenshots are logged as html img tags with src relative to RF output dir
+        if 'yes' != message.get('html') or '<img' not in message['message']:
+            return
+        for src in re.findall(r'<img src="([^"]+)"', message['message']):
+            if not src.startswith('data:'):
+                self.screenshots.append(os.path.join(self.logger.outputdir or '', src))
+
+    def attach_log_file(self, path):
+        if self.run_id is not None:
+            self.attachments.add_to_run(self.run_id, path, 'Run')
 
     def init_site_specific_info(self):
         '''
@@ -135,18 +283,22 @@ class TestRailRunListener(TestRailListener):
         self.milestone, self.plan, self.run = set_testrail_names(self.logger)
 
     def init_testrail_milestone(self):
-        # get milestone ID if it already exists
-        try:
-            milestones = self.testrail.get_milestones(self.project_id)
-        except TestRailAPIError as e:
-            self.logger.log('LISTENER FATAL ERROR: get milestones error: {}: {}\n'.format(e.code, e.error), console=True)
-            self.signal_quit()
-        for m in milestones:
-            if self.milestone == m['name'] and not m['is_completed']:
-                self.milestone_id = m['id']
+        # get ID of Milestone if it already exists and is not completed. ID cached by an earlier run
+        # is checked with one call. otherwise only Milestones not completed are got.
+        self.milestone_id = self.get_cached_testrail_id('milestones', self.milestone, self.testrail.get_milestone,
+                lambda m: self.milestone == m['name'] and not m['is_completed'])
+        created = ' - cached ({})'.format(self.milestone_id) if self.milestone_id is not None else ''
+        if self.milestone_id is None:
+            try:
+                milestones = self.testrail.get_milestones(self.project_id, is_completed=False)
+            except TestRailAPIError as e:
+                self.logger.log('LISTENER FATAL ERROR: get milestones error: {}: {}\n'.format(e.code, e.error), console=True)
+                self.signal_quit()
+            for m in milestones:
+                if self.milestone == m['name'] and not m['is_completed']:
+                    self.milestone_id = m['id']
 
         # create it if it does not exist or is already completed/closed
-        created = ''
         if self.milestone_id is None:
             try:
                 resp = self.testrail.add_milestone(self.project_id, self.milestone)
@@ -155,21 +307,26 @@ class TestRailRunListener(TestRailListener):
                 self.signal_quit()
             self.milestone_id = resp['id']
             created = ' - created ({})'.format(self.milestone_id)
+        self.name_cache.set('milestones', self.milestone, self.milestone_id)
         self.logger.log(' - Using Testrail Milestone [{}]{}\n'.format(self.milestone, created))
 
     def init_testrail_plan(self):
-        # get Plan ID if it already exists
-        try:
-            plans = self.testrail.get_plans(self.project_id, milestone_id=self.milestone_id)
-        except TestRailAPIError as e:
-            self.logger.log('LISTENER FATAL ERROR: get plans error: {}: {}\n'.format(e.code, e.error), console=True)
-            self.signal_quit()
-        for p in plans:
-            if self.plan == p['name'] and not p['is_completed']:
-                self.plan_id = p['id']
+        # get Plan ID if it already exists and is not completed. as for Milestone.
+        cache_key = u'{}/{}'.format(self.milestone_id, self.plan)
+        self.plan_id = self.get_cached_testrail_id('plans', cache_key, self.testrail.get_plan,
+                lambda p: self.plan == p['name'] and not p['is_completed'] and self.milestone_id == p['milestone_id'])
+        created = ' - cached ({})'.format(self.plan_id) if self.plan_id is not None else ''
+        if self.plan_id is None:
+            try:
+                plans = self.testrail.get_plans(self.project_id, milestone_id=self.milestone_id, is_completed=False)
+            except TestRailAPIError as e:
+                self.logger.log('LISTENER FATAL ERROR: get plans error: {}: {}\n'.format(e.code, e.error), console=True)
+                self.signal_quit()
+            for p in plans:
+                if self.plan == p['name'] and not p['is_completed']:
+                    self.plan_id = p['id']
 
         # create it if it does not exist or already closed
-        created = ''
         if self.plan_id is None:
             try:
                 resp = self.testrail.add_plan(self.project_id, self.plan, milestone_id=self.milestone_id)
@@ -178,8 +335,23 @@ class TestRailRunListener(TestRailListener):
                 self.signal_quit()
             self.plan_id = resp['id']
             created = ' - created ({})'.format(self.plan_id)
+        self.name_cache.set('plans', cache_key, self.plan_id)
         self.logger.log(' - Using Testrail Plan [{}]{}\n'.format(self.plan, created))
 
+    def get_cached_testrail_id(self, kind, name, get_entity, is_match):
+        # ID of name in cache if TR entity got with it still matches, otherwise None
+        tr_id = self.name_cache.get(kind, name)
+        if tr_id is None:
+            return None
+        try:
+            if is_match(get_entity(tr_id)):
+                return tr_id
+        except TestRailAPIError:
+            # deleted
+            pass
+        self.name_cache.set(kind, name, None)
+        return None
+
     def init_testrail_testsuite(self, rf_top_level_suite_name):
         # get TR Testsuite ID used for this Run
         try:
@@ -198,6 +370,83 @@ class TestRailRunListener(TestRailListener):
         return self.testsuite_id, 'Adding test results to Testrail from running RF testsuite: {}\n'.format(
                 rf_top_level_suite_name)
 
+    def init_testrail_run(self):
+        # add TR Run to Plan with TR Case IDs of all RF tests in this run. RF suites that are then run
+        # will only add TR Case IDs not found here, e.g. from tests added by pre-run modifiers.
+        tr_case_ids = self.get_rf_suite_model_case_ids(self.rf_suite_model, self.testsuite_id)
+        if tr_case_ids:
+            self.add_case_ids_to_testrail_run(tr_case_ids)
+
+    def get_rf_suite_model_case_ids(self, rf_suite, tr_section_id):
+        # TR Case IDs of all tests in RF suite and its sub suites. Sections and Cases are found in the
+        # suite index the same way they are as each RF suite is run.
+        tr_case_ids = []
+        for rf_test in rf_suite.tests:
+            tr_case_id = self.suite_index.case_id(tr_section_id, rf_test.name)
+            if tr_case_id is not None:
+                tr_case_ids.append(tr_case_id)
+        parent_id = None if tr_section_id == self.testsuite_id else tr_section_id
+        for rf_sub_suite in rf_suite.suites:
+            sub_section_id = self.suite_index.section_id(parent_id, rf_sub_suite.name)
+            if sub_section_id is not None:
+                tr_case_ids.extend(self.get_rf_suite_model_case_ids(rf_sub_suite, sub_section_id))
+        return tr_case_ids
+
+    def init_testrail_suite_index(self):
+        # get all TR Sections and Cases in Testsuite once so suites do not each get them.
+        # if a cache dir is set only Cases changed since last run are received.
+        # parallel robot processes of a shared Run use a cache in its dir if no other is set so only the
+        # first of them gets all of them.
+        cache = None
+        cache_dir = self.srv_info.get('TESTRAIL_CACHE_DIR') or self.shared_run_dir
+        if cache_dir:
+            cache = SuiteCache(cache_dir, self.testrail_server, self.project_id,
+                    self.testsuite_id, max_age=self.srv_info.get('TESTRAIL_CACHE_MAX_AGE', 86400))
+        self.suite_cache = cache
+        self.suite_index = SuiteIndex()
+        try:
+            self.suite_index.load(self.testrail, self.project_id, self.testsuite_id, cache=cache)
+        except TestRailAPIError as e:
+            self.logger.log('LISTENER FATAL ERROR: prefetch sections and cases error: {}: {}\n'.format(e.code, e.error), console=True)
+            self.signal_quit()
+        cached = ' - cache {} ({})'.format(cache.path, cache.refresh) if cache is not None else ''
+        duplicates = sum(len(d) for d in self.suite_index.duplicate_cases.values())
+        duplicates = ' - {} duplicate case titles'.format(duplicates) if duplicates else ''
+        self.logger.log(' - Prefetched {} Testrail sections and {} cases{}{}\n'.format(
+                len(self.suite_index.sections), self.suite_index.case_count, cached, duplicates))
+
+    def refresh_stale_suite_index(self):
+        # Cases deleted in TR stay in the suite cache until it is next fully refreshed. if TR rejects
+        # Case IDs from it, get all Cases again once and forget Case IDs no longer in TR.
+        # returns False if the index is not from a cache or already has all Cases from TR.
+        if self.suite_cache is None or 'full' == self.suite_cache.refresh:
+            return False
+        old_case_ids = self.suite_index.case_ids()
+        self.logger.log(' - Testrail rejected case IDs from cache. Getting all cases again\n', console=True)
+        try:
+            self.suite_cache.invalidate()
+        except sqlite3.Error as e:
+            self.logger.log('\tLISTENER ERROR: invalidate cache error: {}\n'.format(e), console=True)
+            return False
+        self.init_testrail_suite_index()
+        self.stale_case_ids.update(old_case_ids.difference(self.suite_index.case_ids()))
+        for title2caseid in self.title2caseid.values():
+            for title, tr_case_id in list(title2caseid.items()):
+                if tr_case_id in self.stale_case_ids:
+                    del title2caseid[title]
+        return True
+
+    def send_plan_entry_case_ids(self, send, tr_case_ids):
+        # call send with TR Case IDs. if they are rejected as stale they are sent again without those
+        # no longer in TR. returns response of send and Case IDs sent.
+        try:
+            return send(tr_case_ids), tr_case_ids
+        except TestRailAPIError as e:
+            if 400 != e.code or not self.refresh_stale_suite_index():
+                raise
+        tr_case_ids = [c for c in tr_case_ids if c not in self.stale_case_ids]
+        return send(tr_case_ids), tr_case_ids
+
     def init_testrail_section(self, rf_suite_name, tests):
         # last TR section ID pushed to suite queue is the parent of this RF suite name being processed.
         # but if that ID is also the testrail testsuite ID then this section has no parent id to be
@@ -206,21 +455,23 @@ class TestRailRunListener(TestRailListener):
         if cur_parent_id == self.testsuite_id:
             cur_parent_id = None
 
-        # get all TR sections in testsuite
-        try:
-            tr_sections = self.testrail.get_sections(self.project_id, self.testsuite_id)
-        except TestRailAPIError as e:
-            self.logger.log('LISTENER FATAL ERROR: get sections error: {}: {}\n'.format(e.code, e.error), console=True)
-            self.signal_quit()
-
-        # find current section ID if it exists ensuring parent_id is correct.
-        # tr_section['parent_id'] will be None if this is a top-level TR section.
-        # this is so sections with the same name but in different places do not get
-        # used just because they were seen first.
-        tr_section_id = None
-        for tr_section in tr_sections:
-            if rf_suite_name == tr_section['name'] and cur_parent_id == tr_section['parent_id']:
-                tr_section_id = tr_section['id']
+        if self.suite_index is not None:
+            # all TR sections were prefetched and are indexed by parent ID and name
+            tr_section_id = self.suite_index.section_id(cur_parent_id, rf_suite_name)
+        else:
+            # get all TR sections in testsuite.
+            # find current section ID if it exists ensuring parent_id is correct.
+            # tr_section['parent_id'] will be None if this is a top-level TR section.
+            # this is so sections with the same name but in different places do not get
+            # used just because they were seen first.
+            tr_section_id = None
+            try:
+                for tr_section in self.testrail.iter_sections(self.project_id, self.testsuite_id):
+                    if rf_suite_name == tr_section['name'] and cur_parent_id == tr_section['parent_id']:
+                        tr_section_id = tr_section['id']
+            except TestRailAPIError as e:
+                self.logger.log('LISTENER FATAL ERROR: get sections error: {}: {}\n'.format(e.code, e.error), console=True)
+                self.signal_quit()
 
         # should exist
         msg = '{}.{}'.format(self.suite_queue.current_path(), rf_suite_name)
@@ -236,47 +487,167 @@ class TestRailRunListener(TestRailListener):
             # no tests in this suite to add
             return
 
-        # get testrail Case from TR Section ID mapped to RF suite name
-        try:
-            tr_cases = self.testrail.get_cases(self.project_id, self.testsuite_id, tr_section_id)
-        except TestRailAPIError as e:
-            self.logger.log('LISTENER FATAL ERROR: get test cases error: {}: {}\n'.format(e.code, e.error), console=True)
-            self.signal_quit()
+        # get dict of TR Case title to ID of TR Section, and IDs of titles that are not unique
+        if self.suite_index is not None:
+            # all TR Cases were prefetched and are indexed by section ID and title
+            section_cases = self.suite_index.section_cases(tr_section_id)
+            duplicates = self.suite_index.duplicate_cases.get(tr_section_id, {})
+        else:
+            # get testrail Case from TR Section ID mapped to RF suite name. only Cases of RF
+            # tests are kept so the whole section is not held in memory.
+            rf_titles = set(rf_tests)
+            section_cases = {}
+            duplicates = {}
+            try:
+                for tr_case in self.testrail.iter_cases(self.project_id, self.testsuite_id, tr_section_id):
+                    tr_title = tr_case['title']
+                    if tr_title in rf_titles:
+                        if tr_title in section_cases:
+                            duplicates.setdefault(tr_title, [section_cases[tr_title]]).append(tr_case['id'])
+                        section_cases[tr_title] = tr_case['id']
+            except TestRailAPIError as e:
+                self.logger.log('LISTENER FATAL ERROR: get test cases error: {}: {}\n'.format(e.code, e.error), console=True)
+                self.signal_quit()
 
-        # get the list of TR Case IDs. also update RF-test-title to TR-section-title map.
-        self.title2caseid[tr_section_id] = {}
-        tr_case_ids = []
+        # update RF-test-title to TR-Case-ID map. one lookup per RF test.
+        title2caseid = self.title2caseid[tr_section_id] = {}
         for rf_title in rf_tests:
-            for tr_case in tr_cases:
-                tr_title = tr_case['title']
-                if rf_title == tr_title:
-                    tr_case_id = tr_case['id']
-                    tr_case_ids.append(tr_case_id)
-                    self.title2caseid[tr_section_id][tr_title] = tr_case_id
+            tr_case_id = section_cases.get(rf_title)
+            if tr_case_id is None:
+                continue
+            title2caseid[rf_title] = tr_case_id
+            if rf_title in duplicates:
+                # log but do not quit. last Case seen is used.
+                self.logger.log('\tLISTENER ERROR: Testrail case title [{}] is not unique in its section: case IDs {}. Using {}\n'.format(
+                        rf_title, ', '.join(str(i) for i in duplicates[rf_title]), tr_case_id), console=True)
+        tr_case_ids = sorted(set(title2caseid.values()))
 
         # add/update TR Run in Plan
-        if self.run_id is None:
-            # first test cases so add to Plan a test Run entry with these TR Case IDs
-            try:
-                resp = self.testrail.add_plan_entry(self.plan_id, self.testsuite_id, self.run,
-                        case_ids=tr_case_ids, include_all=False, assignedto_id=self.user_id)
-            except TestRailAPIError as e:
-                self.logger.log('LISTENER FATAL ERROR: add plan entry error: {}: {}\n'.format(e.code, e.error), console=True)
-                self.signal_quit()
+        self.add_case_ids_to_testrail_run(tr_case_ids)
 
-            # TR api response is just the entry in the Plan so this is the easiest time to
-            # get the entry ID and Run ID.  Note this assumes for now that TR Configurations
-            # are not used so there is only one Run in the Plan entry
-            self.run_id = resp['runs'][0]['id']
-            self.entry_id = resp['id']
-            created = ' - created ({})'.format(self.run_id)
-            self.logger.log(' - Using Testrail Run [{}] - created ({})\n'.format(self.run, self.run_id))
+    def add_case_ids_to_testrail_run(self, tr_case_ids):
+        if self.coordinator is not None:
+            self.add_case_ids_to_shared_testrail_run(tr_case_ids)
+        elif self.run_id is None:
+            self.add_testrail_run(tr_case_ids)
         else:
-            # just update existing test run
-            try:
-                resp = self.testrail.update_plan_entry(self.plan_id, self.entry_id,
-                        run_id=self.run_id, case_ids=tr_case_ids)
-            except TestRailAPIError as e:
-                self.logger.log('LISTENER FATAL ERROR: update plan entry error: {}: {}\n'.format(e.code, e.error), console=True)
-                self.signal_quit()
+            self.update_testrail_run(tr_case_ids)
+
+    def get_shared_run_dir(self):
+        # dir of shared Run state. by default the dir of the outputdirs pabot gives its processes,
+        # which pabot empties at the start of each of its runs.
+        if not self.srv_info.get('TESTRAIL_SHARED_RUN', False):
+            return None
+        if BuiltIn().get_variable_value('${PABOTQUEUEINDEX}') is None and not (
+                self.srv_info.get('TESTRAIL_SHARED_RUN_DIR') and self.srv_info.get('TESTRAIL_SHARED_RUN_ID')):
+            self.logger.log(' - Not run by pabot and no TESTRAIL_SHARED_RUN_DIR and TESTRAIL_SHARED_RUN_ID. Testrail Run is not shared\n')
+            return None
+        if self.srv_info.get('TESTRAIL_SHARED_RUN_DIR'):
+            return self.srv_info['TESTRAIL_SHARED_RUN_DIR']
+        return os.path.dirname(os.path.abspath(self.get_output_dir()))
+
+    def get_shared_run_id(self):
+        # ID of this invocation of parallel robot processes so the state of an earlier one in a
+        # shared Run dir that is kept is not used. pabot empties the dir of the outputdirs of its
+        # processes at the start of each of its runs so an ID written there is new for each run.
+        if self.srv_info.get('TESTRAIL_SHARED_RUN_ID'):
+            return u'{}'.format(self.srv_info['TESTRAIL_SHARED_RUN_ID'])
+        return invocation_id(os.path.dirname(os.path.abspath(self.get_output_dir())))
+
+    def init_shared_testrail_plan(self):
+        # processes of this invocation with the same Milestone, Plan, and Run names share them
+        try:
+            key = u'{}|{}|{}|{}|{}|{}|{}'.format(self.get_shared_run_id(), self.testrail_server, self.project_id,
+                    self.testsuite_id, self.milestone, self.plan, self.run)
+            self.coordinator = RunCoordinator(self.shared_run_dir, key)
+        except (ValueError, OSError) as e:
+            self.logger.log(' - Testrail Run is not shared: {}\n'.format(e))
+            self.init_testrail_milestone()
+            self.init_testrail_plan()
+            return
 
+        # first process finds or adds Milestone and Plan while the others wait to use them
+        with self.coordinator.exclusive():
+            with self.coordinator.state() as state:
+                self.load_shared_testrail_run(state)
+            if self.plan_id is None:
+                self.init_testrail_milestone()
+                self.init_testrail_plan()
+                with self.coordinator.state() as state:
+                    state['milestone_id'] = self.milestone_id
+                    state['plan_id'] = self.plan_id
+            else:
+                self.logger.log(' - Using Testrail Milestone [{}] - shared ({})\n'.format(self.milestone, self.milestone_id))
+                self.logger.log(' - Using Testrail Plan [{}] - shared ({})\n'.format(self.plan, self.plan_id))
+        self.logger.log(' - Sharing Testrail Run with parallel robot processes - {}\n'.format(self.coordinator.path))
+
+    def load_shared_testrail_run(self, state):
+        # TR IDs other processes have added to shared state
+        self.milestone_id = state.get('milestone_id')
+        self.plan_id = state.get('plan_id')
+        if self.run_id is None and state.get('run_id') is not None:
+            self.logger.log(' - Using Testrail Run [{}] - shared ({})\n'.format(self.run, state['run_id']))
+        self.run_id = state.get('run_id')
+        self.entry_id = state.get('entry_id')
+        self.run_case_ids = set(state.get('case_ids', []))
+
+    def add_case_ids_to_shared_testrail_run(self, tr_case_ids):
+        # Case IDs not yet in Run are pending until a process sends them with those of other processes
+        with self.coordinator.state() as state:
+            self.load_shared_testrail_run(state)
+            new_case_ids = set(tr_case_ids).difference(self.run_case_ids)
+            pending = new_case_ids.union(state.get('pending_case_ids', []))
+            state['pending_case_ids'] = sorted(pending)
+        if not new_case_ids:
+            return
+
+        with self.coordinator.exclusive():
+            # another process may have sent them while this one waited
+            with self.coordinator.state() as state:
+                self.load_shared_testrail_run(state)
+                pending = state.get('pending_case_ids', [])
+            if not pending:
+                return
+            if self.run_id is None:
+                self.add_testrail_run(pending)
+            else:
+                self.update_testrail_run(pending)
+            with self.coordinator.state() as state:
+                state['run_id'] = self.run_id
+                state['entry_id'] = self.entry_id
+                state['case_ids'] = sorted(self.run_case_ids)
+                # other processes may have added Case IDs since they were read
+                state['pending_case_ids'] = [c for c in state.get('pending_case_ids', [])
+                        if c not in self.run_case_ids and c not in self.stale_case_ids]
+
+    def add_testrail_run(self, tr_case_ids):
+        # first test cases so add to Plan a test Run entry with these TR Case IDs
+        try:
+            resp, tr_case_ids = self.send_plan_entry_case_ids(lambda case_ids: self.testrail.add_plan_entry(
+                    self.plan_id, self.testsuite_id, self.run, case_ids=case_ids, include_all=False,
+                    assignedto_id=self.user_id), tr_case_ids)
+        except TestRailAPIError as e:
+            self.logger.log('LISTENER FATAL ERROR: add plan entry error: {}: {}\n'.format(e.code, e.error), console=True)
+            self.signal_quit()
+
+        # TR api response is just the entry in the Plan so this is the easiest time to
+        # get the entry ID and Run ID.  Note this assumes for now that TR Configurations
+        # are not used so there is only one Run in the Plan entry
+        self.run_id = resp['runs'][0]['id']
+        self.entry_id = resp['id']
+        self.run_case_ids.update(tr_case_ids)
+        self.logger.log(' - Using Testrail Run [{}] - created ({})\n'.format(self.run, self.run_id))
+
+    def update_testrail_run(self, tr_case_ids):
+        # just update existing test run. Case IDs already in Run are known so there is no
+        # need to have the TR api client get them from the Run.
+        if self.run_case_ids.issuperset(tr_case_ids):
+            return
+        case_ids = sorted(self.run_case_ids.union(tr_case_ids))
+        try:
+            resp, case_ids = self.send_plan_entry_case_ids(lambda case_ids: self.testrail.update_plan_entry(
+                    self.plan_id, self.entry_id, case_ids=case_ids), case_ids)
+        except TestRailAPIError as e:
+            self.logger.log('LISTENER FATAL ERROR: update plan entry error: {}: {}\n'.format(e.code, e.error), console=True)
+            self.signal_quit()
+        self.run_case_ids = set(case_ids)
@@ -0,0 +1,130 @@
+import random
+import threading
+
+
+# upper bounds in secs of latency histogram buckets. last bucket has no upper bound.
+HISTOGRAM_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5)
+
+
+class CallStats(object):
+
+    '''
+    Latencies and counts of calls by name, e.g. TR api endpoints or Listener events.
+
+    record() can be called from any thread.  Each call can add to named counts, e.g. bytes sent,
+    which are summed for its name.  Memory does not grow with the number of calls: percentiles
+    are of a random sample of up to sample_size latencies of a name, which is all of them until
+    there are more.  Count, total, max, and histogram are of all calls.
+    '''
+
+
+    def __init__(self, sample_size=10000):
+        self.sample_size = sample_size
+        # name: _Call
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, secs, **counts):
+        with self._lock:
+            call = self._calls.get(name)
+            if call is None:
+                call = self._calls[name] = _Call()
+            call.count += 1
+            call.total += secs
+            call.max = max(call.max, secs)
+            call.histogram[_bucket(secs)] += 1
+            # reservoir sample so each latency is equally likely to be kept
+            if len(call.sample) < self.sample_size:
+                call.sample.append(secs)
+            else:
+                i = random.randint(0, call.count - 1)
+                if i < self.sample_size:
+                    call.sample[i] = secs
+            for key, value in counts.items():
+                call.counts[key] = call.counts.get(key, 0) + value
+
+    def total_secs(self):
+        with self._lock:
+            return sum(call.total for call in self._calls.values())
+
+    def summary(self):
+        '''
+        Returns dict by name of count, total, p50, p95, p99, max secs, histogram, and summed counts.
+        '''
+        with self._lock:
+            calls = dict((name, (call.count, call.total, call.max, list(call.histogram), sorted(call.sample),
+                    dict(call.counts))) for name, call in self._calls.items())
+        result = {}
+        for name, (count, total, max_secs, histogram, sample, counts) in calls.items():
+            summary = {
+                'count': count,
+                'total': total,
+                'p50': _percentile(sample, 50),
+                'p95': _percentile(sample, 95),
+                'p99': _percentile(sample, 99),
+                'max': max_secs,
+                'histogram': histogram,
+            }
+            summary.update(counts)
+            result[name] = summary
+        return result
+
+
+class _Call(object):
+
+    __slots__ = ('count', 'total', 'max', 'histogram', 'sample', 'counts')
+
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.sample = []
+        self.counts = {}
+
+
+def format_report(title, summary, top=10):
+    '''
+    Lines of a report of CallStats summary.  Names are ordered by total secs and only the top are
+    listed.  Histogram is of all calls.
+    '''
+    lines = []
+    count = sum(s['count'] for s in summary.values())
+    total = sum(s['total'] for s in summary.values())
+    lines.append('{}: {} calls, {:.3f}s'.format(title, count, total))
+    if not count:
+        return lines
+    names = sorted(summary, key=lambda n: summary[n]['total'], reverse=True)
+    width = max(len(n) for n in names[:top])
+    for name in names[:top]:
+        s = summary[name]
+        extra = ''.join(' {}={}'.format(k, '{:.3f}'.format(s[k]) if isinstance(s[k], float) else s[k]) for k in sorted(s)
+                if k not in ('count', 'total', 'p50', 'p95', 'p99', 'max', 'histogram'))
+        lines.append('  {:<{}} n={:<6} total={:.3f}s p50={:.1f}ms p95={:.1f}ms p99={:.1f}ms max={:.1f}ms{}'.format(
+                name, width, s['count'], s['total'], 1000 * s['p50'], 1000 * s['p95'], 1000 * s['p99'],
+                1000 * s['max'], extra))
+    if len(names) > top:
+        lines.append('  ... {} more'.format(len(names) - top))
+
+    # histogram of all calls
+    histogram = [sum(s['histogram'][i] for s in summary.values()) for i in range(len(HISTOGRAM_BUCKETS) + 1)]
+    labels = ['<{}ms'.format(int(b * 1000)) for b in HISTOGRAM_BUCKETS] + ['>={}ms'.format(int(HISTOGRAM_BUCKETS[-1] * 1000))]
+    most = max(histogram)
+    for label, n in zip(labels, histogram):
+        if n:
+            lines.append('  {:>8} {:<6} {}'.format(label, n, '#' * max(1, 40 * n // most)))
+    return lines
+
+
+def _bucket(secs):
+    for i, bound in enumerate(HISTOGRAM_BUCKETS):
+        if secs < bound:
+            return i
+    return len(HISTOGRAM_BUCKETS)
+
+
+def _percentile(sorted_values, pct):
+    # nearest rank
+    index = max(0, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
@@ -0,0 +1,63 @@
+import collections
+
+
+class KeywordSteps(object):
+
+    '''
+    RF keywords of the current RF test as TR step results, so a failed TR Result shows where the
+    RF test failed without the RF log.
+
+    Only the last max_steps keywords started are kept, so memory does not grow with the keywords a
+    test runs.  Each keyword is a step whose content is its name and args, indented by its depth.
+    Fields are cut to max_field chars.  The message of a failed test is the actual result of its
+    last failed keyword.
+    '''
+
+    STATUS_IDS = {'PASS': 1, 'FAIL': 5}
+
+
+    def __init__(self, max_steps=50, max_field=250):
+        self.max_field = max_field
+        # [depth, name, args, status] of keywords in the order they started
+        self._steps = collections.deque(maxlen=max(1, max_steps))
+        # steps of keywords started and not yet ended
+        self._open = []
+        self._dropped = 0
+
+    def clear(self):
+        self._steps.clear()
+        del self._open[:]
+        self._dropped = 0
+
+    def start_keyword(self, name, attrs):
+        if len(self._steps) == self._steps.maxlen:
+            self._dropped += 1
+        step = [len(self._open), name, attrs.get('args'), None]
+        self._steps.append(step)
+        self._open.append(step)
+
+    def end_keyword(self, name, attrs):
+        if self._open:
+            self._open.pop()[3] = attrs.get('status')
+
+    def step_results(self, message=None):
+        # list of TR step results of kept keywords
+        results = []
+        if self._dropped:
+            results.append({'content': u'... {} earlier keywords'.format(self._dropped)})
+        last_failed = None
+        for depth, name, args, status in self._steps:
+            result = {'content': self._cut(u'{}{}'.format(u'| ' * depth, u'  '.join([name] + list(args or []))))}
+            if status in self.STATUS_IDS:
+                result['status_id'] = self.STATUS_IDS[status]
+            if 'FAIL' == status:
+                last_failed = result
+            results.append(result)
+        if last_failed is not None and message:
+            last_failed['actual'] = self._cut(message)
+        return results
+
+    def _cut(self, value):
+        if len(value) <= self.max_field:
+            return value
+        return value[:max(0, self.max_field - 3)] + u'...'
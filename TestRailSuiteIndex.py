@@ -0,0 +1,201 @@
+import os
+import re
+import sqlite3
+import time
+from TestRailAPIClient import TestRailAPIError
+
+
+class SuiteIndex(object):
+
+    '''
+    In memory index of the Sections and Cases of a TR Test Suite.
+
+    Sections are indexed by (parent_id, name) so Sections with the same name in different places
+    in the Test Suite are kept apart. parent_id is None for top-level Sections.
+    Cases are indexed by section_id and then title so all Cases of a Section are one dict.
+
+    If names or titles are not unique the last one seen is used.  The IDs of all of them are
+    kept in duplicate_sections and duplicate_cases so they can be reported.
+    '''
+
+
+    def __init__(self):
+        self.sections = {}
+        self.cases = {}
+        self.case_count = 0
+        # IDs of Sections and Cases whose names or titles are not unique, by the same keys as the index
+        self.duplicate_sections = {}
+        self.duplicate_cases = {}
+
+    def load(self, testrail, project_id, suite_id, cache=None):
+        # if a SuiteCache is given only what changed since the last run is received from TR
+        if cache is not None:
+            cache.load(testrail, self)
+            return
+        # get all Sections and all Cases of Test Suite. one paged pass each. entries are
+        # indexed as each page is received.
+        for tr_section in testrail.iter_sections(project_id, suite_id):
+            self.add_section(tr_section)
+        for tr_case in testrail.iter_cases(project_id, suite_id):
+            self.add_case(tr_case)
+
+    def add_section(self, tr_section):
+        key = (tr_section['parent_id'], tr_section['name'])
+        _add_unique(self.sections, key, tr_section['id'], self.duplicate_sections)
+
+    def add_case(self, tr_case):
+        section_cases = self.cases.setdefault(tr_case['section_id'], {})
+        if tr_case['title'] not in section_cases:
+            self.case_count += 1
+        _add_unique(section_cases, tr_case['title'], tr_case['id'],
+                self.duplicate_cases.setdefault(tr_case['section_id'], {}))
+
+    def section_cases(self, section_id):
+        # dict of title to ID of Cases of Section
+        return self.cases.get(section_id, {})
+
+    def section_id(self, parent_id, name):
+        return self.sections.get((parent_id, name))
+
+    def case_ids(self):
+        # set of IDs of all Cases indexed
+        return set(case_id for section_cases in self.cases.values() for case_id in section_cases.values())
+
+    def materialize_sections(self, concurrent, project_id, suite_id, paths):
+        '''
+        Find or create the TR Sections of RF suite paths.  A path is a tuple of RF suite names
+        below the top-level RF suite.  Parents of paths are included even if not given.
+
+        Sections are created a level at a time.  The Sections of a level only depend on the level
+        above so they are created concurrently with ConcurrentTestRailClient concurrent.
+
+        Returns dict of path to section ID, and list of paths whose Section was created.
+        Raises TestRailAPIError of first failed creation after its level is done.
+        '''
+        levels = {}
+        for path in paths:
+            for depth in range(1, len(path) + 1):
+                levels.setdefault(depth, set()).add(tuple(path[:depth]))
+
+        section_ids = {}
+        created = []
+        for depth in sorted(levels):
+            missing = []
+            for path in sorted(levels[depth]):
+                parent_id = section_ids[path[:-1]] if depth > 1 else None
+                section_id = self.section_id(parent_id, path[-1])
+                if section_id is None:
+                    missing.append((path, parent_id))
+                else:
+                    section_ids[path] = section_id
+
+            responses = concurrent.gather([concurrent.add_section(project_id, suite_id, path[-1], parent_id=parent_id)
+                    for path, parent_id in missing], return_exceptions=True)
+            errors = []
+            for (path, parent_id), resp in zip(missing, responses):
+                if isinstance(resp, TestRailAPIError):
+                    errors.append(resp)
+                    continue
+                self.add_section(resp)
+                section_ids[path] = resp['id']
+                created.append(path)
+            if errors:
+                raise errors[0]
+        return section_ids, created
+
+    def case_id(self, section_id, title):
+        return self.cases.get(section_id, {}).get(title)
+
+
+def _add_unique(index, key, tr_id, duplicates):
+    # last ID of a key is used. all IDs of a key seen more than once are kept in duplicates
+    if key in index and index[key] != tr_id:
+        ids = duplicates.setdefault(key, [index[key]])
+        if tr_id not in ids:
+            ids.append(tr_id)
+    index[key] = tr_id
+
+
+class SuiteCache(object):
+
+    '''
+    SQLite file cache of the Sections and Cases of a TR Test Suite.  There is one file per
+    TR server, Project, and Test Suite in cache_dir.
+
+    On load() Sections are all received again as they are few.  Only Cases updated since the
+    newest Case in the cache are received using get_cases updated_after filter.  Deleted Cases
+    are not reported by TR so all Cases are received again when the cache is older than max_age secs,
+    or on the next load() after invalidate() e.g. when TR rejects a Case ID found in the cache.
+    '''
+
+
+    def __init__(self, cache_dir, server, project_id, suite_id, max_age=86400):
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        name = re.sub(r'[^\w.-]', '_', '{}_{}_{}'.format(server, project_id, suite_id))
+        self.path = os.path.join(cache_dir, 'tr_suite_{}.sqlite'.format(name))
+        self.project_id = project_id
+        self.suite_id = suite_id
+        self.max_age = max_age
+        # what was done on last load(). for logging
+        self.refresh = None
+
+    def load(self, testrail, index):
+        # parallel runs can share a cache so wait on another run's refresh
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            self._create(db)
+            # take write lock before reading so two runs do not both do a full refresh
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                self._refresh(db, testrail)
+            except Exception:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+            for section_id, parent_id, name in db.execute('SELECT id, parent_id, name FROM sections'):
+                index.add_section({'id': section_id, 'parent_id': parent_id, 'name': name})
+            for case_id, section_id, title in db.execute('SELECT id, section_id, title FROM cases'):
+                index.add_case({'id': case_id, 'section_id': section_id, 'title': title})
+        finally:
+            db.close()
+
+    def invalidate(self):
+        # receive all Cases again on next load()
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            self._create(db)
+            db.execute("DELETE FROM meta WHERE key = 'full_refresh'")
+        finally:
+            db.close()
+
+    def _create(self, db):
+        db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)')
+        db.execute('CREATE TABLE IF NOT EXISTS sections (id INTEGER PRIMARY KEY, parent_id INTEGER, name TEXT)')
+        db.execute('CREATE TABLE IF NOT EXISTS cases '
+                   '(id INTEGER PRIMARY KEY, section_id INTEGER, title TEXT, updated_on INTEGER)')
+
+    def _refresh(self, db, testrail):
+        meta = dict(db.execute('SELECT key, value FROM meta'))
+        now = int(time.time())
+
+        db.execute('DELETE FROM sections')
+        db.executemany('INSERT INTO sections VALUES (?, ?, ?)',
+                ((s['id'], s['parent_id'], s['name']) for s in testrail.iter_sections(self.project_id, self.suite_id)))
+
+        updated_after = None
+        if meta.get('full_refresh', 0) > now - self.max_age:
+            # updated_on is TR server time so use newest Case seen instead of this host's clock.
+            # go back one sec as the filter is 'after'; Cases seen again just replace themselves.
+            newest = db.execute('SELECT MAX(updated_on) FROM cases').fetchone()[0]
+            if newest is not None:
+                updated_after = newest - 1
+        if updated_after is None:
+            db.execute('DELETE FROM cases')
+            db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', ('full_refresh', now))
+            self.refresh = 'full'
+        else:
+            self.refresh = 'updated after {}'.format(updated_after)
+        db.executemany('INSERT OR REPLACE INTO cases VALUES (?, ?, ?, ?)',
+                ((c['id'], c['section_id'], c['title'], c.get('updated_on'))
+                 for c in testrail.iter_cases(self.project_id, self.suite_id, updated_after=updated_after)))
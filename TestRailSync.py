@@ -0,0 +1,173 @@
+#
+# Sync TestRail Suite, Sections, and Cases with RF suites without running robot.
+#
+# RF suite files are parsed with robot's model api and compared to the TR Test Suite of
+# the same name as the top-level RF suite, which is received in one bulk pass. Only what
+# is missing in TR is created: the Test Suite, then Sections a level at a time, then Cases.
+# Sections and Cases are matched the same way TestRailCasesListener matches them.
+#
+# Usage:
+#
+#   python TestRailSync.py [--plan] [robot options] data_sources
+#
+# --plan only prints what would be created. robot options such as --suite, --test,
+# --include, and --exclude select the RF tests as they would for robot.
+#
+import argparse
+import codecs
+import sys
+
+from robot.errors import DataError
+from TestRailAPIClient import TestRailAPIError
+from TestRailConcurrent import ConcurrentTestRailClient
+from TestRailListener import build_rf_suite_model
+from TestRailListener import create_testrail_client
+from TestRailSuiteIndex import SuiteCache
+from TestRailSuiteIndex import SuiteIndex
+
+# import Testrail server info
+try:
+    from  TestRailServer import get_testrail_srv_info
+except ImportError as e:
+    raise ValueError('Function not imported from TestRailServer.py.  Error: {}'.format(e))
+
+
+class SuiteSync(object):
+
+    '''
+    Diff of an RF suite tree against a TR Test Suite.
+
+    diff() finds what is missing in TR.  Paths of RF suites are tuples of suite names below the
+    top-level RF suite, which maps to the TR Test Suite itself.  apply() creates what is missing.
+    '''
+
+
+    def __init__(self, testrail, project_id, concurrency=4, cache_dir=None, server=None):
+        self.testrail = testrail
+        self.project_id = project_id
+        self.concurrency = concurrency
+        self.cache_dir = cache_dir
+        self.server = server
+
+        self.testsuite_name = None
+        self.testsuite_id = None
+        self.index = SuiteIndex()
+        # TR section ID of each RF suite path. None until created
+        self.section_ids = {}
+        # what is missing in TR
+        self.new_sections = []   # RF suite paths. parents before children
+        self.new_cases = []      # (RF suite path, RF test title)
+        self.skipped = []        # RF tests of top-level suite which have no TR section
+
+    def diff(self, rf_suite):
+        self.testsuite_name = rf_suite.name
+        for tr_suite in self.testrail.iter_suites(self.project_id):
+            if rf_suite.name == tr_suite['name']:
+                self.testsuite_id = tr_suite['id']
+
+        index = self.index
+        if self.testsuite_id is not None:
+            cache = None
+            if self.cache_dir:
+                cache = SuiteCache(self.cache_dir, self.server, self.project_id, self.testsuite_id)
+            index.load(self.testrail, self.project_id, self.testsuite_id, cache=cache)
+
+        self.skipped = [t.name for t in rf_suite.tests]
+        # breadth first so parents are before their children
+        queue = [((s.name,), s) for s in rf_suite.suites]
+        while queue:
+            path, suite = queue.pop(0)
+            parent_id = self.section_ids.get(path[:-1])
+            section_id = None
+            if len(path) == 1 or parent_id is not None:
+                section_id = index.section_id(parent_id, path[-1])
+            self.section_ids[path] = section_id
+            if section_id is None:
+                self.new_sections.append(path)
+            for rf_test in suite.tests:
+                if section_id is None or index.case_id(section_id, rf_test.name) is None:
+                    self.new_cases.append((path, rf_test.name))
+            queue.extend((path + (s.name,), s) for s in suite.suites)
+
+    def plan(self):
+        # lines describing what apply() will create
+        lines = []
+        if self.testsuite_id is None:
+            lines.append(u'+ suite   {}'.format(self.testsuite_name))
+        for path in self.new_sections:
+            lines.append(u'+ section {}'.format(u'.'.join((self.testsuite_name,) + path)))
+        for path, title in self.new_cases:
+            lines.append(u'+ case    {}'.format(u'.'.join((self.testsuite_name,) + path + (title,))))
+        for title in self.skipped:
+            lines.append(u'! skipped {}.{} - tests of top-level suite have no section'.format(self.testsuite_name, title))
+        lines.append(u'{} suite, {} sections, {} cases to create'.format(
+                1 if self.testsuite_id is None else 0, len(self.new_sections), len(self.new_cases)))
+        return lines
+
+    def apply(self, log):
+        # create Test Suite, Sections, and Cases in dependency order. log is called with a line of progress.
+        if self.testsuite_id is None:
+            self.testsuite_id = self.testrail.add_suite(self.project_id, self.testsuite_name)['id']
+            log(u'created suite   {} ({})'.format(self.testsuite_name, self.testsuite_id))
+
+        # sections of a level are created concurrently once their parents exist
+        concurrent = ConcurrentTestRailClient(self.testrail, self.concurrency)
+        try:
+            # only has new sections and their parents. existing sections of new cases are from diff()
+            section_ids, created = self.index.materialize_sections(concurrent, self.project_id,
+                    self.testsuite_id, self.new_sections)
+            self.section_ids.update(section_ids)
+            for path in created:
+                log(u'created section {} ({})'.format(u'.'.join((self.testsuite_name,) + path), self.section_ids[path]))
+
+            auto_type = self.testrail.get_automated_test_case_type()
+            responses = concurrent.gather([concurrent.add_case(self.section_ids[path], title, auto_type)
+                    for path, title in self.new_cases], return_exceptions=True)
+        finally:
+            concurrent.close()
+        errors = 0
+        for (path, title), resp in zip(self.new_cases, responses):
+            name = u'.'.join((self.testsuite_name,) + path + (title,))
+            if isinstance(resp, TestRailAPIError):
+                errors += 1
+                log(u'ERROR: add case {} error: [{}: {}]'.format(name, resp.code, resp.error))
+            else:
+                log(u'created case    {} ({})'.format(name, resp['id']))
+        return errors
+
+
+def main(cli_args):
+    parser = argparse.ArgumentParser(usage='python TestRailSync.py [--plan] [robot options] data_sources',
+            description='Create TestRail Suite, Sections, and Cases missing for RF suites')
+    parser.add_argument('--plan', action='store_true', help='only print what would be created')
+    args, robot_args = parser.parse_known_args(cli_args)
+
+    # RF names are unicode. they are encoded for the console, or as UTF-8 if output is piped.
+    out = codecs.getwriter(sys.stdout.encoding or 'utf-8')(sys.stdout, 'replace')
+    srv_info = get_testrail_srv_info()
+    try:
+        rf_suite = build_rf_suite_model(robot_args)
+    except DataError as e:
+        sys.stderr.write('Failed to parse RF suites: {}\n'.format(e))
+        return 252
+
+    testrail = create_testrail_client(srv_info)
+    sync = SuiteSync(testrail, srv_info['TESTRAIL_PROJECT_ID'],
+            concurrency=srv_info.get('TESTRAIL_CONCURRENCY', 4),
+            cache_dir=srv_info.get('TESTRAIL_CACHE_DIR'), server=srv_info['TESTRAIL_SERVER'])
+    try:
+        sync.diff(rf_suite)
+        if args.plan:
+            for line in sync.plan():
+                out.write(line + u'\n')
+            return 0
+        out.write(sync.plan()[-1] + u'\n')
+        errors = sync.apply(lambda line: out.write(line + u'\n'))
+    except TestRailAPIError as e:
+        sys.stderr.write('TestRail error: {}: {}\n'.format(e.code, e.error))
+        return 1
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))